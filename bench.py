@@ -0,0 +1,574 @@
+"""
+Micro-benchmarks for netcrappy.
+
+Run all of them with ``python bench.py``, or pick some by name:
+``python bench.py import_time``.
+"""
+import os
+import re
+import subprocess
+import sys
+import timeit
+
+import netcrappy
+from netcrappy import NaServer
+
+
+def report(label, seconds, number=1):
+    print('  %-44s %10.4f ms' % (label, seconds * 1000.0 / number))
+
+
+def bench_import_time():
+    """Fresh-interpreter 'import netcrappy', and the platform lookup it
+    used to run eagerly. """
+    number = 10
+    here = os.path.dirname(os.path.abspath(__file__))
+    def run(code):
+        subprocess.check_call([sys.executable, '-c', code], cwd=here)
+    report('python -c pass', timeit.timeit(lambda: run('pass'), number=number), number)
+    report('python -c "import netcrappy"',
+           timeit.timeit(lambda: run('import netcrappy'), number=number), number)
+    report('import + first get_nmsdk_platform()',
+           timeit.timeit(lambda: run('import netcrappy.NaServer as s; s.get_nmsdk_platform()'),
+                         number=number), number)
+    # what the old import-time detection cost: two forked commands
+    def popen_detection():
+        for command in ('head -n 1 /etc/issue', 'uname -p'):
+            pipe = os.popen(command)
+            pipe.readline()
+            pipe.close()
+    if sys.platform.startswith('linux'):
+        report('os.popen based detection (old)', timeit.timeit(popen_detection, number=number), number)
+    report('get_platform_info() (in-process)',
+           timeit.timeit(NaServer.NaServer.get_platform_info, number=number), number)
+
+
+def bench_build_request():
+    """Per-call cost of building a small request document. """
+    conn = NaServer.NaServer('filer1', 1, 19)
+    conn.set_admin_user('admin', 'secret')
+    conn.set_vserver('vs1')
+    req = netcrappy.NaElement('volume-get-iter')
+    req.child_add_string('max-records', '100')
+    number = 20000
+    report('build_request()', timeit.timeit(lambda: conn.build_request(req), number=number), number)
+    report('build_request() for another vserver',
+           timeit.timeit(lambda: conn.build_request(req, 'vs2'), number=number), number)
+
+
+def bench_tracing():
+    """Per-call cost of the tracing hooks, with tracing off and on. """
+    from netcrappy.NaTrace import NULL_TRACER, NaTracer
+    out = netcrappy.NaElement('results')
+    out.attr_set('status', 'passed')
+    def call(tracer):
+        span = tracer.start_span('filer1', 'volume-get-iter', None)
+        span.set_request_bytes(100)
+        for phase in ('serialize', 'connect', 'send', 'wait', 'read', 'parse'):
+            span.phase(phase)
+        span.finish(out)
+    number = 100000
+    report('span hooks, tracing off', timeit.timeit(lambda: call(NULL_TRACER), number=number), number)
+    report('span hooks, tracing on (no exporter)',
+           timeit.timeit(lambda: call(NaTracer()), number=number), number)
+
+
+def bench_metrics():
+    """Per-call cost of recording a call in the metrics registry. """
+    from netcrappy.NaMetrics import NaMetricsRegistry
+    registry = NaMetricsRegistry()
+    number = 100000
+    report('NaMetricsRegistry.record()',
+           timeit.timeit(lambda: registry.record('filer1', 'volume-get-iter', 0.0123, 0, 300, 5000),
+                         number=number), number)
+
+
+class LegacyElement:
+    """The layout NaElement had before __slots__: an instance dict
+    holding a dict of five entries per element. """
+
+    def __init__(self, name, value=None):
+        self.element = {'name': name, 'content': "", 'children': [],
+                        'attrkeys': [], 'attrvals': []}
+        if value is not None:
+            self.element['content'] = value
+
+    def child_add(self, child):
+        self.element['children'].append(child)
+
+
+def volume_tree(cls, count):
+    """A volume-get-iter like response of 'count' volumes with 24
+    elements each. """
+    attributes_list = cls('attributes-list')
+    for i in range(count):
+        volume = cls('volume-attributes')
+        for group in ('volume-id-attributes', 'volume-space-attributes',
+                      'volume-state-attributes'):
+            attrs = cls(group)
+            for j in range(6):
+                attrs.child_add(cls('field-%d' % j, str(i * j)))
+            volume.child_add(attrs)
+        for j in range(4):
+            volume.child_add(cls('flag-%d' % j, 'true'))
+        attributes_list.child_add(volume)
+    return attributes_list
+
+
+def bench_element_memory():
+    """Memory held by a 20k-volume response tree, per element. """
+    try:
+        import tracemalloc
+    except ImportError:
+        print('  needs tracemalloc (Python 3.4+)')
+        return
+    count = 20000
+    nodes = count * 24 + 1
+    for (label, cls) in (('dict layout (old)', LegacyElement),
+                         ('__slots__ NaElement', netcrappy.NaElement)):
+        tracemalloc.start()
+        tree = volume_tree(cls, count)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tree
+        print('  %-44s %10.1f MB %6d bytes/element' % (label, size / 1e6, size // nodes))
+
+
+def bench_child_get():
+    """Field lookups on a volume-space-attributes sized element. """
+    elem = netcrappy.NaElement('volume-space-attributes')
+    fields = ['field-%d' % i for i in range(30)]
+    for field in fields:
+        elem.child_add_string(field, '1')
+    def lookups():
+        for field in fields:
+            elem.child_get_string(field)
+    number = 20000
+    report('30 child_get_string() calls, indexed', timeit.timeit(lookups, number=number), number)
+    netcrappy.NaElement.INDEX_MIN_CHILDREN = 1000
+    elem.index = None
+    try:
+        report('30 child_get_string() calls, linear scan', timeit.timeit(lookups, number=number), number)
+    finally:
+        netcrappy.NaElement.INDEX_MIN_CHILDREN = 8
+    for i in range(30, 2000):
+        elem.child_add_string('field-%d' % i, '1')
+    report('30 child_get_string() calls, 2000 children', timeit.timeit(lookups, number=number), number)
+
+
+def legacy_encoded_string(elem):
+    """toEncodedString() as it was: recursive, concatenating strings
+    and checking each child's class with a regular expression. """
+    s = "<" + elem.name
+    attrs = elem.attrs or ()
+    for j in range(0, len(attrs), 2):
+        s = s + " " + str(attrs[j]) + "=\"" + str(attrs[j + 1]) + "\""
+    s = s + ">"
+    for c in elem.children or ():
+        if not re.search("NaElement.NaElement", str(c.__class__), re.I):
+            sys.exit("unexpected reference")
+        s = s + legacy_encoded_string(c)
+    s = s + netcrappy.NaElement.escapeHTML(str(elem.content))
+    return s + "</" + elem.name + ">"
+
+
+def bench_serialize():
+    """toEncodedString() of wide and deep trees, against the old
+    recursive string concatenation. """
+    wide = netcrappy.ontap7mode.dict_to_naelement(
+        {'nfs-exportfs-append-rules-2': {'rules': {'exports-rule-info-2': [
+            {'pathname': '/vol/vol%d' % i,
+             'security-rules': {'security-rule-info': {'root': {'exports-hostname-info': {'name': 'host%d' % i}}}}}
+            for i in range(2000)]}}})
+    deep = elem = netcrappy.NaElement('level')
+    for i in range(500):
+        child = netcrappy.NaElement('level', 'x')
+        elem.child_add(child)
+        elem = child
+    number = 20
+    for (label, tree) in (('wide (2000 rules)', wide), ('deep (500 levels)', deep)):
+        report('%s, old' % label, timeit.timeit(lambda: legacy_encoded_string(tree), number=number), number)
+        report('%s, toEncodedString()' % label, timeit.timeit(tree.toEncodedString, number=number), number)
+    report('wide, sprintf()', timeit.timeit(wide.sprintf, number=number), number)
+
+
+def legacy_escape_html(cont):
+    """escapeHTML() as it was: ten regular expression passes. """
+    for (char, entity) in (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'),
+                           ("'", '&apos;'), ('"', '&quot;')):
+        cont = re.sub(char, entity, cont)
+    for entity in ('&amp;', '&lt;', '&gt;', '&apos;', '&quot;'):
+        cont = re.sub('&amp;' + entity[1:], entity, cont)
+    return cont
+
+
+def volume_response(count):
+    """The body of a volume-get-iter response of 'count' volumes. """
+    return ("<?xml version='1.0' encoding='UTF-8' ?><netapp version='1.19'>"
+            "<results status=\"passed\">%s</results></netapp>"
+            % volume_tree(netcrappy.NaElement, count).toEncodedString()).encode('utf-8')
+
+
+def bench_escape():
+    """escapeHTML() on values without and with special characters,
+    and its share in parsing and serializing. """
+    number = 100000
+    for text in ('vol_data_0001', 'R&D <"eng">'):
+        report('old escape %r' % text, timeit.timeit(lambda: legacy_escape_html(text), number=number), number)
+        report('escapeHTML(%r)' % text,
+               timeit.timeit(lambda: netcrappy.NaElement.escapeHTML(text), number=number), number)
+    body = volume_response(2000)
+    tree = volume_tree(netcrappy.NaElement, 2000)
+    def parse():
+        parser = NaServer.NaResponseParser()
+        parser.feed(body, 1)
+    number = 5
+    escape = netcrappy.NaElement.escapeHTML
+    for (label, function) in (('old escape', legacy_escape_html), ('escapeHTML', escape)):
+        netcrappy.NaElement.escapeHTML = staticmethod(function)
+        try:
+            report('parse 2000 volumes (%.1f MB), %s' % (len(body) / 1e6, label),
+                   timeit.timeit(parse, number=number), number)
+            report('toEncodedString() 2000 volumes, %s' % label,
+                   timeit.timeit(tree.toEncodedString, number=number), number)
+        finally:
+            netcrappy.NaElement.escapeHTML = staticmethod(escape)
+
+
+class LegacyTextParser(NaServer.NaResponseParser):
+    """NaResponseParser adding each piece of text to the element as it
+    arrives, as it used to. """
+
+    def __init__(self):
+        NaServer.NaResponseParser.__init__(self)
+        self.parser.buffer_text = False
+
+    def end_element(self, name):
+        self.ZAPI_text[-1] = None
+        NaServer.NaResponseParser.end_element(self, name)
+
+    def char_data(self, data):
+        self.ZAPI_stack[-1].add_content(netcrappy.NaElement.escapeHTML(data))
+
+
+def bench_parse_long_text():
+    """Parsing a system-cli response with a long output, fed in
+    network-sized pieces. """
+    for lines in (5000, 20000):
+        output = ''.join('%6d  vol%d  online  RW  1.2TB  &  more\n' % (i, i) for i in range(lines))
+        body = ('<netapp><results status="passed"><cli-output>%s</cli-output></results></netapp>'
+                % output.replace('&', '&amp;')).encode('utf-8')
+        def parse(cls):
+            parser = cls()
+            for i in range(0, len(body), 1460):
+                parser.feed(body[i:i + 1460])
+            parser.feed(b'', 1)
+        for (label, cls) in (('text added as it arrives', LegacyTextParser),
+                             ('text joined at end_element', NaServer.NaResponseParser)):
+            report('%.1f MB, %s' % (len(body) / 1e6, label),
+                   timeit.timeit(lambda: parse(cls), number=1))
+
+
+def bench_parse_backends():
+    """Parse throughput of the response parse backends, alone and with
+    one field read per volume or the whole tree walked. """
+    body = volume_response(5000)
+    conn = NaServer.NaServer('filer1', 1, 19)
+    def parse():
+        parser = conn.new_parser()
+        for i in range(0, len(body), NaServer.READ_CHUNK_SIZE):
+            parser.feed(body[i:i + NaServer.READ_CHUNK_SIZE])
+        parser.feed(b'', 1)
+        return conn.get_results(parser.get_root())
+    def read_names():
+        for volume in parse().child_get('attributes-list').children_get():
+            volume.child_get('volume-id-attributes').child_get_string('field-0')
+    def walk():
+        stack = [parse()]
+        while stack:
+            elt = stack.pop()
+            elt.content
+            stack.extend(elt.children_get())
+    number = 3
+    for backend in NaServer.PARSE_BACKENDS:
+        conn.set_parse_backend(backend)
+        report('%s: parse %.1f MB' % (backend, len(body) / 1e6), timeit.timeit(parse, number=number), number)
+        report('%s: parse, one field per volume' % backend, timeit.timeit(read_names, number=number), number)
+        report('%s: parse, walk all elements' % backend, timeit.timeit(walk, number=number), number)
+
+
+def bench_parse_memory():
+    """Peak memory of parsing a 3.4 MB response and reading the first
+    volume or one field per volume, with each response parse
+    backend. """
+    try:
+        import tracemalloc
+    except ImportError:
+        print('  needs tracemalloc (Python 3.4+)')
+        return
+    body = volume_response(5000)
+    conn = NaServer.NaServer('filer1', 1, 19)
+    def read_first(out):
+        out.child_get('attributes-list').children_get()[0].child_get('volume-id-attributes')
+    def read_names(out):
+        for volume in out.child_get('attributes-list').children_get():
+            volume.child_get('volume-id-attributes').child_get_string('field-0')
+    for backend in NaServer.PARSE_BACKENDS:
+        conn.set_parse_backend(backend)
+        for (label, read) in (('first volume', read_first), ('one field per volume', read_names)):
+            tracemalloc.start()
+            parser = conn.new_parser()
+            for i in range(0, len(body), NaServer.READ_CHUNK_SIZE):
+                parser.feed(body[i:i + NaServer.READ_CHUNK_SIZE])
+            parser.feed(b'', 1)
+            out = conn.get_results(parser.get_root())
+            read(out)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del parser, out
+            print('  %-40s %10.1f MB peak' % ('%s: %s' % (backend, label), peak / 1e6))
+
+
+def bench_select():
+    """Three fields of 20000 volumes with child_get() chains per
+    record and with a compiled NaElement.select(). """
+    tree = volume_tree(netcrappy.NaElement, 20000)
+    def chains():
+        names, used, flags = [], [], []
+        for volume in tree.children_get():
+            names.append(volume.child_get('volume-id-attributes').child_get_string('field-0'))
+            used.append(volume.child_get('volume-space-attributes').child_get_int('field-1'))
+            flags.append(volume.child_get_string('flag-0') == 'true')
+    def select():
+        tree.select('volume-id-attributes/field-0', 'volume-space-attributes/field-1:int',
+                    'flag-0:bool')
+    number = 5
+    report('child_get chains, 20000 volumes', timeit.timeit(chains, number=number), number)
+    report('select(), 20000 volumes', timeit.timeit(select, number=number), number)
+
+
+def bench_binary():
+    """Loading a cached 10000-volume response from NaBinary data, from
+    pickle and by parsing its XML again. """
+    from netcrappy import NaBinary
+    import pickle
+    tree = volume_tree(netcrappy.NaElement, 10000)
+    xml = tree.toEncodedString().encode('utf-8')
+    data = NaBinary.dumps(tree)
+    pickled = pickle.dumps(tree, 2)
+    conn = NaServer.NaServer('filer1', 1, 19)
+    number = 3
+    report('toEncodedString(), %.1f MB' % (len(xml) / 1e6),
+           timeit.timeit(tree.toEncodedString, number=number), number)
+    report('NaBinary.dumps(), %.1f MB' % (len(data) / 1e6),
+           timeit.timeit(lambda: NaBinary.dumps(tree), number=number), number)
+    report('parse_raw_xml()', timeit.timeit(lambda: conn.parse_raw_xml(xml), number=number), number)
+    report('pickle.loads(), %.1f MB' % (len(pickled) / 1e6),
+           timeit.timeit(lambda: pickle.loads(pickled), number=number), number)
+    report('NaBinary.loads()', timeit.timeit(lambda: NaBinary.loads(data), number=number), number)
+
+
+def inventory_response(count):
+    """The body of a volume-get-iter response of 'count' volumes, with
+    repeated values (vserver, aggregate, state) next to unique ones. """
+    volumes = ''.join(
+        '<volume-attributes><volume-id-attributes><name>vol%d</name>'
+        '<uuid>%032x</uuid><owning-vserver-name>vs%d</owning-vserver-name>'
+        '<containing-aggregate-name>aggr%d</containing-aggregate-name>'
+        '<style>flex</style><type>rw</type></volume-id-attributes>'
+        '<volume-space-attributes><size-used>%d</size-used>'
+        '<space-guarantee>none</space-guarantee></volume-space-attributes>'
+        '<volume-state-attributes><state>online</state>'
+        '<is-inconsistent>false</is-inconsistent></volume-state-attributes>'
+        '</volume-attributes>' % (i, i, i % 20, i % 8, i * 4096) for i in range(count))
+    return ("<?xml version='1.0' encoding='UTF-8' ?><netapp version='1.19'>"
+            "<results status=\"passed\"><attributes-list>%s</attributes-list>"
+            "</results></netapp>" % volumes).encode('utf-8')
+
+
+def bench_intern():
+    """Memory held by the tree of a 20000-volume response, with and
+    without an intern table for the content. """
+    try:
+        import tracemalloc
+    except ImportError:
+        print('  needs tracemalloc (Python 3.4+)')
+        return
+    body = inventory_response(20000)
+    conn = NaServer.NaServer('filer1', 1, 19)
+    for (label, table) in (('no intern table', None), ('NaInternTable()', netcrappy.NaInternTable())):
+        conn.set_intern_table(table)
+        tracemalloc.start()
+        out = conn.parse_xml(body)
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del out
+        print('  %-44s %10.1f MB' % (label, size / 1e6))
+    number = 3
+    for (label, table) in (('no intern table', None), ('NaInternTable()', netcrappy.NaInternTable())):
+        conn.set_intern_table(table)
+        report('parse, %s' % label, timeit.timeit(lambda: conn.parse_xml(body), number=number), number)
+
+
+def bench_schema():
+    """api_recurse() against the compiled extractor of the same schema,
+    per aggr-get-iter record and per system-get-info output. """
+    from netcrappy.NaSchema import compile_schema
+    from netcrappy import ontap7mode, ontapcmode
+    filer = netcrappy.Filer('filer1', 'admin', 'secret')
+    aggrs = []
+    for i in range(10000):
+        aggr = netcrappy.NaElement('aggr-attributes')
+        aggr.child_add_string('aggregate-name', 'aggr%d' % i)
+        space = netcrappy.NaElement('aggr-space-attributes')
+        for field in ('size-available', 'size-total', 'size-used'):
+            space.child_add_string(field, str(i * 4096))
+        aggr.child_add(space)
+        aggrs.append(aggr)
+    info = netcrappy.NaElement('results')
+    system = netcrappy.NaElement('system-info')
+    for (field, kind) in ontap7mode.SYSTEM_INFO['system-info'].items():
+        if kind == 'integer':
+            system.child_add_string(field, '4')
+        elif kind != False:
+            system.child_add_string(field, 'true')
+    info.child_add(system)
+    for (label, schema, records) in (('aggr-get-iter record', ontapcmode.AGGR_INFO, aggrs),
+                                     ('system-get-info output', ontap7mode.SYSTEM_INFO, [info] * 10000)):
+        extract = compile_schema(schema)
+        number = 3
+        interpreted = timeit.timeit(lambda: [filer.api_recurse(schema, r) for r in records], number=number)
+        compiled = timeit.timeit(lambda: [extract(r) for r in records], number=number)
+        report('api_recurse(), per %s' % label, interpreted / len(records), number)
+        report('compiled, per %s' % label, compiled / len(records), number)
+
+
+def bench_columns():
+    """Used space per field-0 value of 50000 volumes, kept as a list of
+    record dictionaries and as NaColumns, with the memory each keeps. """
+    try:
+        import tracemalloc
+    except ImportError:
+        print('  needs tracemalloc (Python 3.4+)')
+        return
+    from netcrappy.NaPath import NaColumns
+    from netcrappy.NaSchema import compile_schema
+    tree = volume_tree(netcrappy.NaElement, 50000)
+    records = tree.children_get()
+    schema = {'volume-id-attributes': {'field-0': 'string'},
+              'volume-space-attributes': {'field-1': 'integer', 'field-2': 'integer'},
+              'flag-0': 'boolean'}
+    extract = compile_schema(schema)
+    def dicts():
+        rows = [extract(volume) for volume in records]
+        used = {}
+        for row in rows:
+            key = row['volume-id-attributes']['field-0']
+            used[key] = used.get(key, 0) + row['volume-space-attributes']['field-1']
+        return rows
+    def columns():
+        store = NaColumns(['volume-id-attributes/field-0', 'volume-space-attributes/field-1:int',
+                           'volume-space-attributes/field-2:int', 'flag-0:bool'])
+        store.add(records)
+        used = {}
+        for (key, size) in zip(store['volume-id-attributes/field-0'],
+                               store['volume-space-attributes/field-1']):
+            used[key] = used.get(key, 0) + size
+        return store
+    number = 3
+    for (label, function) in (('record dictionaries', dicts), ('NaColumns', columns)):
+        tracemalloc.start()
+        kept = function()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        report('%s, %.1f MB kept' % (label, size / 1e6), timeit.timeit(function, number=number), number)
+
+
+def bench_stream():
+    """Three fields of each volume of a 20000-volume response, parsed
+    into NaElements and extracted with a compiled schema, and
+    extracted while parsing with NaStreamParser, with the peak memory
+    of each. """
+    try:
+        import tracemalloc
+    except ImportError:
+        print('  needs tracemalloc (Python 3.4+)')
+        return
+    from netcrappy.NaSchema import compile_schema
+    from netcrappy.NaStream import NaStreamParser
+    body = volume_response(20000)
+    schema = {'volume-id-attributes': {'field-0': 'string'},
+              'volume-space-attributes': {'field-1': 'integer'},
+              'flag-0': 'boolean'}
+    extract = compile_schema(schema)
+    conn = NaServer.NaServer('filer1', 1, 19)
+    def feed(parser):
+        for i in range(0, len(body), NaServer.READ_CHUNK_SIZE):
+            parser.feed(body[i:i + NaServer.READ_CHUNK_SIZE])
+        parser.feed(b'', 1)
+        return parser
+    def tree():
+        out = conn.get_results(feed(conn.new_parser()).get_root())
+        return [extract(volume) for volume in out.child_get('attributes-list').children_get()]
+    def stream():
+        records = []
+        feed(NaStreamParser(schema, records.append))
+        return records
+    def count():
+        feed(NaStreamParser(schema, lambda record: None))
+    number = 3
+    for (label, function) in (('tree, then compiled schema', tree),
+                              ('NaStreamParser, records kept', stream),
+                              ('NaStreamParser, records dropped', count)):
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        report('%s, %.1f MB peak' % (label, peak / 1e6), timeit.timeit(function, number=number), number)
+
+
+def prune(elt, desired):
+    """A copy of 'elt' with only the children named in the
+    desired-attributes element 'desired', as a filer would send it. """
+    out = netcrappy.NaElement(elt.name, elt.content)
+    wanted = dict((child.name, child) for child in desired.children_get())
+    for child in elt.children_get():
+        if child.name in wanted:
+            if wanted[child.name].children_get():
+                out.child_add(prune(child, wanted[child.name]))
+            else:
+                out.child_add(child)
+    return out
+
+
+def bench_desired_attributes():
+    """Size and parse time of a 10000-volume volume-get-iter page with
+    all attributes, and with the desired-attributes of three fields. """
+    from netcrappy.NaSchema import desired_attributes
+    tree = volume_tree(netcrappy.NaElement, 10000)
+    paths = ('volume-id-attributes/field-0', 'volume-state-attributes/field-1',
+             'flag-0:bool')
+    desired = desired_attributes('volume-attributes', paths).child_get('volume-attributes')
+    pruned = netcrappy.NaElement('attributes-list')
+    for volume in tree.children_get():
+        pruned.child_add(prune(volume, desired))
+    conn = NaServer.NaServer('filer1', 1, 19)
+    number = 3
+    for (label, page) in (('all attributes', tree), ('desired-attributes', pruned)):
+        body = ("<netapp version='1.19'><results status=\"passed\">%s</results></netapp>"
+                % page.toEncodedString()).encode('utf-8')
+        report('%s, %.1f MB' % (label, len(body) / 1e6),
+               timeit.timeit(lambda: conn.parse_xml(body), number=number), number)
+
+
+def main(names):
+    benchmarks = sorted(name[len('bench_'):] for name in globals()
+                        if name.startswith('bench_'))
+    for name in names or benchmarks:
+        print(name)
+        globals()['bench_' + name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,519 @@
+"""
+asyncio counterparts of NaServer, Filer and Cluster.
+
+AsyncNaServer speaks the same ZAPI protocol as NaServer over asyncio
+streams, so that many filers and many calls per filer can be driven
+from one event loop instead of one thread per connection. Requests and
+responses are the usual NaElement objects. Requires Python 3.6 or later.
+"""
+
+import asyncio
+
+from errno import ECONNRESET
+import socket
+import ssl
+import weakref
+
+from .NaServer import NaServer, get_response_parser, is_stale_connection_error
+from .NaServer import ACCEPT_ENCODING, READ_CHUNK_SIZE, REJECTED_ENCODING_STATUSES
+from .NaTrace import clock
+from .NaElement import NaElement
+from .NaSchema import compile_schema, schema_paths
+from .NaPath import NaColumns
+from .NaStream import NaStreamParser
+from . import ontap7mode
+from . import ontapcmode
+
+DEFAULT_MAX_CONNECTIONS = 16
+
+
+class AsyncConnection:
+    """A keep-alive stream pair held in the AsyncNaServer connection
+    pool, with the event loop it belongs to.
+    """
+
+    def __init__(self, reader, writer, loop):
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+
+    def close(self):
+        loop = self.loop
+        if loop.is_closed():
+            # a transport cannot be closed without its loop: end the
+            # connection, the socket is closed when it is collected
+            sock = self.writer.get_extra_info('socket')
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        elif loop.is_running():
+            # the loop may be running in another thread
+            loop.call_soon_threadsafe(self.writer.close)
+        else:
+            self.writer.close()
+
+
+class AsyncNaServer(NaServer):
+    """NaServer whose invoke_elem() and invoke() are coroutines.
+
+    Configuration (transport, style, credentials, vserver, timeout,
+    certificates, connection pool) works exactly as for NaServer.
+    At most 'max_connections' calls per event loop are in flight to
+    the server at once; further calls wait for a free connection. The
+    connection pool is sized to keep that many connections open.
+    Pooled connections are only used by the event loop that opened
+    them, so one AsyncNaServer can be used from several loops in turn,
+    such as consecutive asyncio.run() calls; call close() before a loop
+    ends to close its connections cleanly.
+    """
+
+    def __init__(self, server, major_version, minor_version):
+        NaServer.__init__(self, server, major_version, minor_version)
+        self.max_connections = DEFAULT_MAX_CONNECTIONS
+        self.pool.size = DEFAULT_MAX_CONNECTIONS
+        # semaphores by event loop, as each is bound to one
+        self.semaphores = weakref.WeakKeyDictionary()
+
+    def set_max_connections(self, max_connections):
+        """Sets the number of calls that may be in flight at once, and
+        the size of the connection pool to match; call
+        set_connection_pool() afterwards for another pool size.
+        """
+
+        self.max_connections = max_connections
+        self.pool.size = max_connections
+        self.semaphores = weakref.WeakKeyDictionary()
+
+    async def invoke_elem(self, req, vserver=None, parser=None):
+        """Submit an XML request already encapsulated as an NaElement
+        and return the result in another NaElement, see
+        NaServer.invoke_elem().
+        """
+
+        if vserver is None:
+            vserver = self.vfiler
+        api = req.name
+        span = self.tracer.start_span(self.server, api, vserver or None)
+        # the latency recorded in the metrics leaves out the time spent
+        # waiting for a free connection
+        latency = 0.0
+        try:
+            out = None
+            while out is None:
+                (content, authheader) = self.build_request(req, vserver)
+                (content, content_encoding) = self.compress_request(content)
+                request_bytes = len(content)
+                span.set_request_bytes(request_bytes)
+                span.phase('serialize')
+                loop = asyncio.get_event_loop()
+                semaphore = self.semaphores.get(loop)
+                if semaphore is None:
+                    semaphore = asyncio.Semaphore(self.max_connections)
+                    self.semaphores[loop] = semaphore
+                async with semaphore:
+                    start = clock()
+                    try:
+                        exchange = self.exchange(content, authheader,
+                                                 content_encoding, span, parser)
+                        if self.timeout is None:
+                            (out, response_bytes) = await exchange
+                        else:
+                            (out, response_bytes) = await asyncio.wait_for(exchange, self.timeout)
+                    except asyncio.TimeoutError:
+                        # failed as a timeout of NaServer.invoke_elem() does
+                        (out, response_bytes) = (self.fail_response(13001, "timed out"), 0)
+                    finally:
+                        latency += clock() - start
+                # None: the compressed request was rejected, send it
+                # uncompressed
+        except BaseException as e:
+            span.finish(error=e)
+            if self.metrics is not None:
+                self.metrics.record(self.server, api, latency, 13001)
+            raise
+        span.finish(out)
+        if self.metrics is not None:
+            error_code = 0
+            if out.results_status() == 'failed':
+                error_code = int(out.results_errno())
+            self.metrics.record(self.server, api, latency, error_code,
+                                request_bytes, response_bytes)
+        return out
+
+    async def invoke(self, api, *arg):
+        """A convenience routine which wraps invoke_elem(), see
+        NaServer.invoke().
+        """
+
+        num_parms = len(arg)
+
+        if ((num_parms & 1) != 0):
+            return self.fail_response(13001, "in Zapi::invoke, invalid number of parameters")
+
+        xi = NaElement(api)
+        for i in range(0, num_parms, 2):
+            xi.child_add(NaElement(arg[i], arg[i + 1]))
+
+        return await self.invoke_elem(xi)
+
+    async def invoke_many(self, requests, max_workers=None):
+        """Coroutine version of NaServer.invoke_many(). By default, up
+        to 'max_connections' requests are in flight at once.
+        """
+
+        requests = list(requests)
+        results = [None] * len(requests)
+        pending = iter(enumerate(requests))
+
+        async def worker():
+            for (index, req) in pending:
+                try:
+                    results[index] = await self.invoke_elem(self.make_request(req))
+                except (Exception, asyncio.TimeoutError) as e:
+                    results[index] = self.fail_response(13001, str(e))
+
+        if max_workers is None:
+            max_workers = self.max_connections
+        await asyncio.gather(*[worker() for i in range(min(max_workers, len(requests)))])
+        return results
+
+    async def exchange(self, content, authheader, content_encoding, span, parser=None):
+        """This is a private function, not to be called from outside AsyncNaServer.
+        Returns the results and the size of the response, parsed by
+        'parser' or a new parser of the parse backend, or None for the
+        results if the server did not accept a compressed request.
+        """
+
+        loop = asyncio.get_event_loop()
+        while True:
+            connection = self.pool.get()
+            if connection is not None and connection.loop is not loop:
+                # opened by another event loop, which cannot serve this one
+                connection.close()
+                continue
+            reused = (connection is not None)
+            try:
+                if not reused:
+                    connection = await self.open_async_connection()
+                span.phase('connect')
+                (version, status, headers) = await self.send_async_request(
+                    connection, content, authheader, content_encoding, span)
+                break
+            except (OSError, asyncio.IncompleteReadError) as e:
+                if connection is not None:
+                    connection.close()
+                # only a pooled connection closed by the server is
+                # retried, see NaServer.invoke_request()
+                if not reused or not is_stale_connection_error(e):
+                    return (self.fail_response(13001, str(e)), 0)
+                self.pool.reconnected()
+            except BaseException:
+                if connection is not None:
+                    connection.close()
+                raise
+
+        if status == 401:
+            connection.close()
+            return (self.fail_response(13002, "Authorization failed"), 0)
+
+        failed = (content_encoding is not None and status != 200)
+        if failed:
+            parser = None
+        else:
+            if parser is None:
+                parser = self.new_parser()
+            parser = span.track_parser(
+                get_response_parser(headers.get('content-encoding'), parser))
+        try:
+            (will_close, response_bytes) = await self.read_async_body(
+                connection, version, headers, parser)
+            if parser is not None:
+                parser.feed(b'', 1)
+        except BaseException:
+            connection.close()
+            raise
+
+        if will_close:
+            connection.close()
+        else:
+            self.pool.put(connection)
+
+        span.phase('read')
+        if failed:
+            if status not in REJECTED_ENCODING_STATUSES:
+                return (self.fail_response(13001, "HTTP status %d" % status), response_bytes)
+            self.request_compression_supported = False
+            return (None, response_bytes)
+        out = self.get_results(parser.get_root())
+        span.phase('parse')
+        return (out, response_bytes)
+
+    async def open_async_connection(self):
+        """This is a private function, not to be called from outside AsyncNaServer
+        """
+
+        context = None
+        if self.transport_type == "HTTPS":
+            context = self.get_ssl_context()
+        (reader, writer) = await asyncio.open_connection(self.server, self.port,
+                                                         ssl=context)
+        connection = AsyncConnection(reader, writer, asyncio.get_event_loop())
+
+        if context is not None and self.need_cn_verification:
+            cn_name = ""
+            cert = writer.get_extra_info('peercert') or {}
+            for x in cert.get('subject', ()):
+                if x[0][0].lower() == 'commonname':
+                    cn_name = x[0][1]
+            if cn_name.lower() != self.server.lower():
+                connection.close()
+                raise ssl.SSLError("server certificate verification failed: server certificate name (CN=" + cn_name + "), hostname (" + self.server + ") mismatch.")
+
+        return connection
+
+    async def send_async_request(self, connection, content, authheader,
+                                 content_encoding, span):
+        """This is a private function, not to be called from outside AsyncNaServer.
+        Returns the HTTP version, status and headers of the response.
+        """
+
+        head = ["POST %s HTTP/1.1" % self.url,
+                "Host: %s:%s" % (self.server, self.port),
+                "Content-Type: text/xml; charset=\"UTF-8\"",
+                "Content-Length: %d" % len(content)]
+        if authheader is not None:
+            head.append("Authorization: " + authheader)
+        if self.compression:
+            head.append("Accept-Encoding: " + ACCEPT_ENCODING)
+        if content_encoding is not None:
+            head.append("Content-Encoding: " + content_encoding)
+        connection.writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1') + content)
+        await connection.writer.drain()
+        span.phase('send')
+
+        reader = connection.reader
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError(ECONNRESET, "connection closed by server")
+        parts = line.split(None, 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            (key, sep, value) = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        span.phase('wait')
+        return (parts[0], int(parts[1]), headers)
+
+    async def read_async_body(self, connection, version, headers, parser):
+        """This is a private function, not to be called from outside AsyncNaServer.
+        Feeds the response body to 'parser' as it arrives and returns
+        whether the server is closing the connection and the size of
+        the body. A parser of None discards the body.
+        """
+
+        size = 0
+        def feed(data):
+            nonlocal size
+            size += len(data)
+            if parser is not None:
+                parser.feed(data)
+        reader = connection.reader
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            while True:
+                chunk_size = int((await reader.readline()).split(b';')[0], 16)
+                if chunk_size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                feed(await reader.readexactly(chunk_size))
+                await reader.readexactly(2)
+        elif 'content-length' in headers:
+            remaining = int(headers['content-length'])
+            while remaining > 0:
+                chunk = await reader.read(min(remaining, READ_CHUNK_SIZE))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b'', remaining)
+                feed(chunk)
+                remaining -= len(chunk)
+        else:
+            while True:
+                chunk = await reader.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    return (True, size)
+                feed(chunk)
+
+        connection_header = headers.get('connection', '').lower()
+        if connection_header == 'close':
+            return (True, size)
+        return (version == b'HTTP/1.0' and connection_header != 'keep-alive', size)
+
+
+class AsyncFiler:
+    '''
+    asyncio counterpart of ontap7mode.Filer.
+    '''
+    api_recurse = ontap7mode.Filer.api_recurse
+
+    def __init__(self, filer_name, user, password, transport_type='HTTPS', apiversion=(1,19)):
+        conn = AsyncNaServer(filer_name, apiversion[0], apiversion[1])
+        out = conn.set_transport_type(transport_type)
+        ontap7mode.check_zapi_error(out, "connection to filer failed: %s")
+        out = conn.set_style("LOGIN")
+        ontap7mode.check_zapi_error(out, "connection to filer failed: %s")
+        out = conn.set_admin_user(user, password)
+        ontap7mode.check_zapi_error(out, "connection to filer failed: %s")
+        self.conn = conn
+
+    async def invoke(self, *args):
+        """Coroutine version of Filer.invoke().
+        """
+        out = await self.conn.invoke(*args)
+        ontap7mode.check_zapi_error(out)
+        return out
+
+    async def invoke_elem(self, naelem, vserver=None, parser=None):
+        """Coroutine version of Filer.invoke_elem().
+        """
+        out = await self.conn.invoke_elem(naelem, vserver, parser)
+        ontap7mode.check_zapi_error(out)
+        return out
+
+    async def invoke_many(self, requests, max_workers=None):
+        """Coroutine version of Filer.invoke_many().
+        """
+        outputs = await self.conn.invoke_many(requests, max_workers)
+        for i, out in enumerate(outputs):
+            try:
+                ontap7mode.check_zapi_error(out)
+            except ontap7mode.NetCrAPIOut as e:
+                outputs[i] = e
+        return outputs
+
+    async def invoke_cli(self, command):
+        """Coroutine version of Filer.invoke_cli().
+        """
+        args = NaElement('args')
+        for arg in command.split():
+            args.child_add(NaElement('arg', arg))
+        cli = NaElement('system-cli')
+        cli.child_add(args)
+        return await self.invoke_elem(cli)
+
+    async def get_aggrs(self):
+        """Coroutine version of Filer.get_aggrs().
+        """
+        out = await self.invoke('aggr-list-info')
+        aggr_info = compile_schema(ontap7mode.AGGR_LIST_INFO)(out)
+        return aggr_info['aggregates']
+
+    async def system_info(self):
+        """Coroutine version of Filer.system_info().
+        """
+        out = await self.invoke('system-get-info')
+        sysinfo = compile_schema(ontap7mode.SYSTEM_INFO)(out)
+        return sysinfo['system-info']
+
+    def close(self):
+        """Closes the idle connections to the filer.
+        """
+        self.conn.close()
+
+
+class AsyncCluster(AsyncFiler):
+    '''
+    asyncio counterpart of ontapcmode.Cluster.
+    '''
+
+    def __init__(self, filer_name, user, password, transport_type='HTTPS'):
+        AsyncFiler.__init__(self, filer_name, user, password,
+                            transport_type=transport_type)
+
+    def set_vserver(self, vserver):
+        """Sets the vserver of the connection.
+        """
+        self.conn.set_vserver(vserver)
+
+    async def api_get_iter(self, iter_api, vserver=None, desired=None):
+        """Async generator over the records of an iter API, fetching
+        the next page once the current one has been consumed. With
+        'desired', the server is only asked for those values, see
+        Cluster.api_get_iter().
+        """
+        desired = ontapcmode.iter_desired_attributes(iter_api, desired)
+        iter_in = ontapcmode.iter_request(iter_api, desired)
+        while True:
+            objs = await self.invoke_elem(iter_in, vserver)
+            attributes_list = objs.child_get('attributes-list')
+            if attributes_list is not None:
+                for obj in attributes_list.children_get():
+                    yield obj
+            next_tag = objs.child_get_string('next-tag')
+            if next_tag is None:
+                return
+            iter_in = ontapcmode.iter_request(iter_api, desired, next_tag)
+
+    async def api_get_columns(self, iter_api, columns, vserver=None, numpy=False):
+        """Coroutine version of Cluster.api_get_iter() with 'columns':
+        returns a dict of the columns of 'columns' by path.
+        """
+        if isinstance(columns, dict):
+            columns = schema_paths(columns)
+        store = NaColumns(columns)
+        batch = []
+        async for obj in self.api_get_iter(iter_api, vserver, columns):
+            batch.append(obj)
+            if len(batch) >= 512:
+                store.add(batch)
+                batch = []
+        store.add(batch)
+        return store.to_dict(numpy)
+
+    async def api_stream_iter(self, iter_api, schema, callback=None, vserver=None):
+        """Coroutine version of Cluster.api_stream_iter().
+        """
+        if callback is None:
+            records = []
+            callback = records.append
+        else:
+            records = None
+        count = 0
+        desired = ontapcmode.iter_desired_attributes(iter_api, schema)
+        iter_in = ontapcmode.iter_request(iter_api, desired)
+        while True:
+            parser = NaStreamParser(schema, callback,
+                                    intern_table=self.conn.get_intern_table())
+            objs = await self.invoke_elem(iter_in, vserver, parser)
+            count += parser.count
+            next_tag = objs.child_get_string('next-tag')
+            if next_tag is None:
+                break
+            iter_in = ontapcmode.iter_request(iter_api, desired, next_tag)
+        if records is None:
+            return count
+        return records
+
+    async def get_vservers(self):
+        """Coroutine version of Cluster.get_vservers().
+        """
+        vservers = [vserver async for vserver in
+                    self.api_get_iter('vserver-get-iter', desired=ontapcmode.VSERVER_PATHS)]
+        return ontapcmode.vserver_records(vservers)
+
+    async def get_volumes(self, vserver=None):
+        """Coroutine version of Cluster.get_volumes().
+        """
+        if vserver and vserver not in await self.get_vservers():
+            raise ontap7mode.NetCrAPIOut('VServer does not exist')
+        volumes = [volume async for volume in
+                   self.api_get_iter('volume-get-iter', vserver, ontapcmode.VOLUME_PATHS)]
+        return ontapcmode.volume_records(volumes)
+
+    async def get_aggrs(self):
+        """Coroutine version of Cluster.get_aggrs().
+        """
+        aggrs = [aggr async for aggr in self.api_get_iter('aggr-get-iter', desired=ontapcmode.AGGR_INFO)]
+        return ontapcmode.aggr_records(aggrs)
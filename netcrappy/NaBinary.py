@@ -0,0 +1,192 @@
+#============================================================#
+#                                                            #
+# NaBinary.py                                                #
+#                                                            #
+# Binary serialization of NaElement trees.                   #
+#                                                            #
+#============================================================#
+
+"""
+A compact binary form of NaElement trees, for caching responses on
+disk or passing them between processes without writing and parsing
+XML again. dumps() returns the bytes of a tree and loads() the tree
+of NaElements back; dump() and load() do the same with files.
+
+The data starts with a header of counts, followed by a table of the
+distinct strings of the tree (names, contents, attribute keys and
+values), UTF-8 coded and separated by NUL characters, which XML
+cannot carry. Then come arrays of little-endian 32 bit integers: the
+string number of the name and of the content of every element, in
+breadth-first order, the element numbers and child counts of the
+elements with children, and an (element, key, value) triple per
+attribute. In breadth-first order the children of an element follow
+one another, so loads() gives each element a slice of the list of
+all elements as its children, and equal strings are shared.
+"""
+
+import array
+import struct
+import sys
+
+from .NaElement import NaElement
+
+MAGIC = b"NaB1"
+
+#magic, string count, string table size, element count, parent count,
+#attribute count
+HEADER = struct.Struct("<4sIIIII")
+
+#array type code of 32 bit unsigned integers
+if (array.array("I").itemsize == 4):
+    INT_CODE = "I"
+else :
+    INT_CODE = "L"
+
+BIG_ENDIAN = (sys.byteorder == "big")
+
+try:
+    text_type = unicode
+except NameError:
+    text_type = str
+
+
+def int_array(values=()):
+    """This is a private function, not to be called from outside NaBinary.
+    """
+
+    return array.array(INT_CODE, values)
+
+
+def array_bytes(values):
+    """This is a private function, not to be called from outside NaBinary.
+    """
+
+    if (BIG_ENDIAN):
+        values.byteswap()
+    if (hasattr(values, "tobytes")):
+        return values.tobytes()
+    return values.tostring()
+
+
+def bytes_array(data):
+    """This is a private function, not to be called from outside NaBinary.
+    """
+
+    values = int_array()
+    if (hasattr(values, "frombytes")):
+        values.frombytes(data)
+    else :
+        values.fromstring(data)
+    if (BIG_ENDIAN):
+        values.byteswap()
+    return values
+
+
+def dumps(elt):
+    """Returns the NaElement 'elt' and its descendants as bytes, see
+    NaBinary. Raises ValueError if a string of the tree contains a NUL
+    character.
+    """
+
+    strings = []
+    numbers = {}
+    names = int_array()
+    contents = int_array()
+    parents = int_array()
+    counts = int_array()
+    attrs = int_array()
+    queue = [elt]
+    i = 0
+    while (i < len(queue)):
+        elt = queue[i]
+        name = numbers.get(elt.name)
+        if (name == None):
+            name = numbers[elt.name] = len(strings)
+            strings.append(elt.name)
+        names.append(name)
+        value = elt.content
+        if (value == None):
+            value = ""
+        content = numbers.get(value)
+        if (content == None):
+            content = numbers[value] = len(strings)
+            strings.append(value)
+        contents.append(content)
+        if (elt.attrs):
+            for value in elt.attrs:
+                if (value not in numbers):
+                    numbers[value] = len(strings)
+                    strings.append(value)
+            pairs = elt.attrs
+            for j in range(0, len(pairs), 2):
+                attrs.extend((i, numbers[pairs[j]], numbers[pairs[j + 1]]))
+        children = elt.children
+        if (children):
+            parents.append(i)
+            counts.append(len(children))
+            queue.extend(children)
+        i = i + 1
+    for (j, value) in enumerate(strings):
+        if (not isinstance(value, text_type)):
+            strings[j] = value = str(value)
+    table = "\0".join(strings)
+    if (table.count("\0") != len(strings) - 1):
+        raise ValueError("NaBinary::dumps: NUL character in element")
+    table = table.encode("utf-8")
+    header = HEADER.pack(MAGIC, len(strings), len(table), len(names),
+                         len(parents), len(attrs) // 3)
+    return b"".join([header, table, array_bytes(names), array_bytes(contents),
+                     array_bytes(parents), array_bytes(counts), array_bytes(attrs)])
+
+
+def loads(data):
+    """Returns the tree of NaElements in 'data', bytes returned by
+    dumps(). Raises ValueError if 'data' is not such bytes.
+    """
+
+    if (len(data) < HEADER.size or data[:4] != MAGIC):
+        raise ValueError("NaBinary::loads: not NaBinary data")
+    (magic, string_count, table_size, element_count, parent_count,
+     attr_count) = HEADER.unpack(data[:HEADER.size])
+    pos = HEADER.size + table_size
+    if (len(data) != pos + 4 * (2 * element_count + 2 * parent_count + 3 * attr_count)):
+        raise ValueError("NaBinary::loads: truncated NaBinary data")
+    strings = data[HEADER.size:pos].decode("utf-8").split("\0")
+    if (len(strings) != string_count):
+        raise ValueError("NaBinary::loads: corrupt string table")
+    values = bytes_array(data[pos:])
+    get = strings.__getitem__
+    names = map(get, values[:element_count])
+    contents = map(get, values[element_count:2 * element_count])
+    elts = list(map(NaElement, names, contents))
+    pos = 2 * element_count
+    first = 1
+    parents = values[pos:pos + parent_count]
+    counts = values[pos + parent_count:pos + 2 * parent_count]
+    for (i, count) in zip(parents, counts):
+        elts[i].children = elts[first:first + count]
+        first = first + count
+    pos = pos + 2 * parent_count
+    for j in range(pos, pos + 3 * attr_count, 3):
+        elt = elts[values[j]]
+        if (elt.attrs == None):
+            elt.attrs = []
+        elt.attrs.append(strings[values[j + 1]])
+        elt.attrs.append(strings[values[j + 2]])
+    return elts[0]
+
+
+def dump(elt, output):
+    """Writes the NaElement 'elt' to the binary file 'output', see
+    dumps().
+    """
+
+    output.write(dumps(elt))
+
+
+def load(input):
+    """Reads a tree of NaElements from the binary file 'input', see
+    loads().
+    """
+
+    return loads(input.read())
@@ -17,7 +17,20 @@ __version__ = 1.0
 import re
 import sys
 
-class NaElement :
+#characters escaped by NaElement.escapeHTML(), and the entity names
+#it leaves alone
+ESCAPE_RE = re.compile(r"&(?!(?:amp|lt|gt|apos|quot);)|[<>'\"]")
+UNESCAPE_RE = re.compile(r"&(?:amp|lt|gt|apos|quot);")
+ENTITIES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', "'": '&apos;', '"': '&quot;'}
+CHARACTERS = dict((v, k) for (k, v) in ENTITIES.items())
+
+def escape_match(match):
+    return ENTITIES[match.group()]
+
+def unescape_match(match):
+    return CHARACTERS[match.group()]
+
+class NaElement(object) :
     """Class encapsulating Netapp XML request elements.
 
     An NaElement encapsulates one level of an XML element.
@@ -31,20 +44,57 @@ class NaElement :
     accessing the contents of NaElements.
     """ 
 
+    # A response holds one NaElement per XML element, so they are kept
+    # small: the children list and the attributes (a flat list of
+    # keys and values) are only allocated when there are any. Elements
+    # with many children get a name->child index on first lookup, unless
+    # their children list has been handed out (the index is then False).
+    __slots__ = ('name', 'content', 'children', 'attrs', 'index')
 
     #Global Variables
     DEFAULT_KEY = "#u82fyi8S5\017pPemw"
     MAX_CHUNK_SIZE = 256
 
+    #elements with fewer children are searched linearly
+    INDEX_MIN_CHILDREN = 8
+
 
     def __init__(self, name, value=None):
         """Construct a new NaElement.  The 'value' parameter is
         optional for top level elements.
         """ 
 
-        self.element = {'name':name,'content':"",'children':[],'attrkeys':[],'attrvals':[]}
+        self.name = name
         if (value != None) :
-            self.element['content'] = value
+            self.content = value
+        else :
+            self.content = ""
+        self.children = None
+        self.attrs = None
+        self.index = None
+
+
+
+    def __getstate__(self):
+        return (self.name, self.content, self.children, self.attrs)
+
+
+
+    def __setstate__(self, state):
+        (self.name, self.content, self.children, self.attrs) = state
+        self.index = None
+
+
+
+    @property
+    def element(self):
+        """The element as a dictionary with the keys 'name', 'content',
+        'children', 'attrkeys' and 'attrvals', as kept by earlier
+        versions of NaElement. Changes made through it are applied
+        to the element.
+        """
+
+        return NaElementDict(self)
 
 
     def results_status(self) :
@@ -101,11 +151,20 @@ class NaElement :
         'name', or None if none is found.
         """ 
 
-        arr = self.element['children']
+        arr = self.children
+
+        if (arr == None):
+            return None
+
+        index = self.index
+        if (index == None and len(arr) >= self.INDEX_MIN_CHILDREN):
+            index = self.get_index()
+        if (index):
+            return index.get(name)
 
         for i in arr :
 
-            if(name == i.element['name']):
+            if(name == i.name):
                 return i
 
         return None
@@ -116,7 +175,7 @@ class NaElement :
         not needed in normal development.
         """ 
 
-        self.element['content'] = content
+        self.content = content
 
 
     def add_content(self, content):
@@ -124,7 +183,7 @@ class NaElement :
         not needed in normal development.
         """ 
 
-        self.element['content'] = self.element['content']+content
+        self.content = self.content+content
         return
 
 
@@ -133,9 +192,9 @@ class NaElement :
         """Returns 1 if the element has any children, 0 otherwise
         """ 
 
-        arr = self.element['children']
+        arr = self.children
 
-        if(len(arr)>0):
+        if(arr != None and len(arr)>0):
             return 1
 
         else :
@@ -148,9 +207,13 @@ class NaElement :
         the current object, which is also an element.
         """ 
 
-        arr = self.element['children']
-        arr.append(child)
-        self.element['children'] = arr
+        if (self.children == None):
+            self.children = [child]
+        else :
+            self.children.append(child)
+            index = self.index
+            if (index and child.name not in index):
+                index[child.name] = child
 
 
 
@@ -171,11 +234,10 @@ class NaElement :
         found, returns None.
         """ 
 
-        elts = self.element['children']
+        elt = self.child_get(name)
 
-        for elt in elts:
-            if (name == elt.element['name']):
-                return elt.element['content']
+        if (elt != None):
+            return elt.content
 
         return None
 
@@ -196,8 +258,26 @@ class NaElement :
         """Returns the list of children as an array.
         """ 
 
-        elts = self.element['children']
-        return elts
+        if (self.children == None):
+            self.children = []
+        # the list may be changed in place from now on, so the element
+        # stops using its child index
+        self.index = False
+        return self.children
+
+
+
+    def select(self, *paths):
+        """Treats the children of the element as records and
+        returns a list of columns, one per path, with the value of
+        the path in each child (see NaPath). For example
+            (names, used) = attributes_list.select(
+                'volume-id-attributes/name',
+                'volume-space-attributes/size-used:int')
+        """
+
+        from .NaPath import select
+        return select(self.children_get(), *paths)
 
 
 
@@ -211,38 +291,9 @@ class NaElement :
         Parameter 'indent' is optional.
         """ 
 
-        name = self.element['name']
-        s = indent+"<"+name
-        keys = self.element['attrkeys']
-        vals = self.element['attrvals']
-        j = 0
-
-        for i in keys:
-            s = s+" "+str(i)+"=\""+str(vals[j])+"\""
-            j = j+1
-
-        s = s+">"
-        children = self.element['children']
-
-        if(len(children) > 0):
-            s = s+"\n"
-
-        for i in children:
-            c = i
-
-            if (not re.search('NaElement.NaElement', str(c.__class__), re.I)):
-                sys.exit("Unexpected reference found, expected NaElement.NaElement not "+ str(c.__class__)+"\n")
-
-            s = s+c.sprintf(indent + "\t")
-
-        self.element['content'] = NaElement.escapeHTML(self.element['content'])
-        s = s + str(self.element['content'])
-
-        if(len(children) > 0):
-            s = s+indent
-
-        s = s+"</"+name+">\n"
-        return s
+        out = []
+        self.write(out, indent)
+        return "".join(out)
 
 
 
@@ -297,32 +348,78 @@ class NaElement :
         Example :
         server.invoke("qtree-create","qtree","abc<qt0","volume","vol0")
         """ 
-        n = self.element['name']
-        s = "<"+n
-        keys = self.element['attrkeys']
-        vals = self.element['attrvals']
-        j = 0
 
-        for i in keys :
-            s = s+" "+str(i)+"=\""+str(vals[j])+"\""
-            j = j+1
+        out = []
+        self.write(out)
+        return "".join(out)
 
-        s = s+">"
-        children = self.element['children']
 
-        for i in children :
-            c = i
-                      
-            if (not re.search("NaElement.NaElement",str(c.__class__),re.I)):
-                sys.exit("Unexpected reference found, expected NaElement.NaElement not "+ str(c.__class__)+"\n")
 
-            s = s+c.toEncodedString()
+    def write(self, out, indent=None):
+        """Writes the element and its children to 'out', a list (which
+        the pieces are appended to) or a file-like object with a
+        write() method, in one pass over the tree and without
+        changing it. By default the output is that of
+        toEncodedString(); with an 'indent' string it is that of
+        sprintf(indent).
+
+        Example :
+        with open('request.xml', 'w') as f:
+            elem.write(f)
+        """
 
-        cont = str(self.element['content'])
-        cont = NaElement.escapeHTML(cont)
-        s = s+cont
-        s = s+"</"+n+">"
-        return s
+        if (isinstance(out, list)):
+            emit = out.append
+        else :
+            emit = out.write
+        escape = NaElement.escapeHTML
+        pretty = (indent != None)
+        if (not pretty):
+            indent = ""
+        # pending work: an element to write with its indent, or the
+        # closing text of an element whose children have been written
+        stack = [(self, indent, None)]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            (elt, indent, close) = pop()
+
+            if (close != None):
+                emit(close)
+                continue
+
+            if (not isinstance(elt, NaElement)):
+                sys.exit("Unexpected reference found, expected NaElement.NaElement not "+ str(elt.__class__)+"\n")
+
+            name = elt.name
+            attrs = elt.attrs
+            children = elt.children
+            if (attrs):
+                s = "<"+name
+                for j in range(0, len(attrs), 2):
+                    s = s+" "+str(attrs[j])+"=\""+str(attrs[j+1])+"\""
+                s = s+">"
+            else :
+                s = "<"+name+">"
+            close = escape(str(elt.content))
+            if (pretty):
+                if (children):
+                    s = s+"\n"
+                    close = close+indent
+                close = close+"</"+name+">\n"
+                emit(indent+s)
+            else :
+                close = close+"</"+name+">"
+                emit(s)
+
+            if (children):
+                push((None, None, close))
+                child_indent = indent+"\t"
+                for i in range(len(children) - 1, -1, -1):
+                    push((children[i], child_indent, None))
+            else :
+                emit(close)
 
 
 
@@ -339,23 +436,31 @@ class NaElement :
         This method converts reserved HTML characters to corresponding entity names.
         """
 
-        cont = re.sub(r'&','&amp;',cont,count=0)
-        cont = re.sub(r'<','&lt;',cont,count=0)
-        cont = re.sub(r'>','&gt;',cont,count=0)
-        cont = re.sub(r"'",'&apos;',cont,count=0)
-        cont = re.sub(r'"','&quot;',cont,count=0)
+        # most values have nothing to escape
+        if ('&' not in cont and '<' not in cont and '>' not in cont and
+                "'" not in cont and '"' not in cont):
+            return cont
 
         """ The existence of '&' (ampersand) sign in entity names implies that multiple calls
-	to this function will result in non-idempotent encoding. So, to handle such situation
-	or when the input itself contains entity names, we reconvert such recurrences to
-	appropriate characters.
+	to this function would result in non-idempotent encoding. So, to handle such situation
+	or when the input itself contains entity names, an '&' that already starts one of the
+	entity names is left as it is.
+        """
+        return ESCAPE_RE.sub(escape_match, cont)
+
+
+
+    @staticmethod
+
+    def unescapeHTML(cont):
+        """ Converts the entity names written by escapeHTML() back to
+        characters, as in the content of the elements of a response.
         """
-        cont = re.sub(r'&amp;amp;','&amp;',cont,count=0)
-        cont = re.sub(r'&amp;lt;','&lt;',cont,count=0)
-        cont = re.sub(r'&amp;gt;','&gt;',cont,count=0)
-        cont = re.sub(r'&amp;apos;','&apos;',cont,count=0)
-        cont = re.sub(r'&amp;quot;','&quot;',cont,count=0)
-        return cont
+
+        if ('&' not in cont):
+            return cont
+
+        return UNESCAPE_RE.sub(unescape_match, cont)
 
     def RC4(self, key, value):
         """This is a private function, not to be called from outside NaElement.
@@ -414,12 +519,11 @@ class NaElement :
         """This is a private function, not to be called from outside NaElement.
         """ 
 
-        arr = self.element['attrkeys']
-        arr.append(key)
-        self.element['attrkeys'] = arr
-        arr = self.element['attrvals']
-        arr.append(value)
-        self.element['attrvals'] = arr
+        if (self.attrs == None):
+            self.attrs = [key, value]
+        else :
+            self.attrs.append(key)
+            self.attrs.append(value)
 
 
 
@@ -427,14 +531,260 @@ class NaElement :
         """This is a private function, not to be called from outside NaElement.
         """ 
 
-        keys = self.element['attrkeys']
-        vals = self.element['attrvals']
-        j = 0
+        attrs = self.attrs
 
-        for i in keys:
-            if(i == key):
-                return vals[j]
-
-            j = j+1
+        if (attrs != None):
+            for j in range(0, len(attrs), 2):
+                if(attrs[j] == key):
+                    return attrs[j+1]
 
         return None
+
+
+
+    def get_index(self):
+        """This is a private function, not to be called from outside NaElement.
+        Returns the name->child dictionary of the element, mapping each
+        name to its first child of that name. The index is kept, and
+        kept up to date by child_add(), until the children list is
+        handed out by children_get(); after that a new one is built
+        each time.
+        """
+
+        index = self.index
+        if (index):
+            return index
+        index = {}
+        for child in self.children:
+            if (child.name not in index):
+                index[child.name] = child
+        if (self.index == None):
+            self.index = index
+        return index
+
+
+
+class NaElementDict(object) :
+    """The dictionary view of an NaElement returned by its 'element'
+    property, for code written against the dictionary that NaElement
+    used to keep. The 'children' list is the element's own; the
+    'attrkeys' and 'attrvals' lists are copies, which are written back
+    when assigned. This is a private class, not to be used from outside
+    NaElement.
+    """
+
+    __slots__ = ('elt',)
+
+    KEYS = ('name', 'content', 'children', 'attrkeys', 'attrvals')
+
+    def __init__(self, elt):
+        self.elt = elt
+
+    def __getitem__(self, key):
+        elt = self.elt
+        if (key == 'name'):
+            return elt.name
+        if (key == 'content'):
+            return elt.content
+        if (key == 'children'):
+            return elt.children_get()
+        if (key == 'attrkeys'):
+            return list((elt.attrs or [])[0::2])
+        if (key == 'attrvals'):
+            return list((elt.attrs or [])[1::2])
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        elt = self.elt
+        if (key == 'name'):
+            elt.name = value
+        elif (key == 'content'):
+            elt.content = value
+        elif (key == 'children'):
+            elt.children = value
+            elt.index = False
+        elif (key == 'attrkeys' or key == 'attrvals'):
+            keys = self['attrkeys']
+            vals = self['attrvals']
+            if (key == 'attrkeys'):
+                keys = value
+            else :
+                vals = value
+            attrs = []
+            for (k, v) in zip(keys, vals):
+                attrs.append(k)
+                attrs.append(v)
+            elt.attrs = attrs or None
+        else :
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+    def keys(self):
+        return list(self.KEYS)
+
+    def get(self, key, default=None):
+        if (key in self.KEYS):
+            return self[key]
+        return default
+
+
+
+#the tag names of parsed responses, shared by all the parsers so that
+#each name is stored once however many elements and responses have it
+NAMES = {}
+
+def intern_name(name):
+    """This is a private function, not to be called from outside the parsers.
+    Returns the one copy of the tag name 'name'.
+    """
+
+    return NAMES.setdefault(name, name)
+
+
+
+class NaInternTable(object) :
+    """Table of the content values of parsed responses, given to
+    NaServer.set_intern_table(), so that each distinct value of an
+    element name (a state, a vserver or an aggregate name) is stored
+    once. An element name is dropped from the table, and its values
+    no longer interned, once it has had more than 'max_values'
+    distinct values, since its values do not repeat enough; values
+    longer than 'max_length' are never interned. A table may be
+    shared by any number of NaServers.
+    """
+
+    def __init__(self, max_values=256, max_length=128):
+        self.max_values = max_values
+        self.max_length = max_length
+        # values by element name; None for names no longer interned
+        self.names = {}
+
+    def __deepcopy__(self, memo):
+        # shared by copies of an NaServer (see Cluster.vserver())
+        return self
+
+    def intern(self, name, value):
+        """Returns the one copy of 'value' as the content of an
+        element 'name', or 'value' itself if it is not interned.
+        """
+
+        values = self.names.get(name, self)
+        if (values is self):
+            values = self.names.setdefault(name, {})
+        if (values == None or len(value) > self.max_length):
+            return value
+        interned = values.get(value)
+        if (interned != None):
+            return interned
+        if (len(values) >= self.max_values):
+            self.names[name] = None
+            return value
+        return values.setdefault(value, value)
+
+    def stats(self):
+        """Returns a dictionary of the number of interned values per
+        element name, with None for the names no longer interned.
+        """
+
+        out = {}
+        for (name, values) in list(self.names.items()):
+            if (values == None):
+                out[name] = None
+            else :
+                out[name] = len(values)
+        return out
+
+
+
+#value of the NaElementView fields not yet read from the document
+NOT_READ = object()
+
+class NaElementView(NaElement) :
+    """Base class of the NaElements of a parsed response that read their
+    content, children and attributes from the document underneath
+    only when they are first used (see NaEtree and NaLazy). Subclasses
+    implement read_content(), read_children() and read_attrs(); the
+    name is set when the view is created. A view behaves as an
+    NaElement in every way, including changes made to it, and its
+    copies and pickles are plain NaElements.
+    """
+
+    __slots__ = ('view_content', 'view_children', 'view_attrs')
+
+    def __init__(self, name):
+        self.name = name
+        self.view_content = NOT_READ
+        self.view_children = NOT_READ
+        self.view_attrs = NOT_READ
+        self.index = None
+
+    def __reduce_ex__(self, protocol):
+        return (make_naelement, copy_naelement(self).__getstate__())
+
+    def get_content(self):
+        if (self.view_content is NOT_READ):
+            self.view_content = self.read_content()
+        return self.view_content
+
+    def set_content_value(self, content):
+        self.view_content = content
+
+    content = property(get_content, set_content_value)
+
+    def get_children(self):
+        if (self.view_children is NOT_READ):
+            self.view_children = self.read_children()
+        return self.view_children
+
+    def set_children(self, children):
+        self.view_children = children
+
+    children = property(get_children, set_children)
+
+    def get_attrs(self):
+        if (self.view_attrs is NOT_READ):
+            self.view_attrs = self.read_attrs()
+        return self.view_attrs
+
+    def set_attrs(self, attrs):
+        self.view_attrs = attrs
+
+    attrs = property(get_attrs, set_attrs)
+
+
+
+def copy_naelement(elt):
+    """This is a private function, not to be called from outside NaElement.
+    Returns a tree of plain NaElements with the contents of 'elt'.
+    """
+
+    out = NaElement(elt.name)
+    stack = [(elt, out)]
+    while stack:
+        (elt, copy) = stack.pop()
+        copy.content = elt.content
+        if (elt.attrs):
+            copy.attrs = list(elt.attrs)
+        if (elt.children):
+            copy.children = [NaElement(child.name) for child in elt.children]
+            stack.extend(zip(elt.children, copy.children))
+    return out
+
+
+
+def make_naelement(name, content, children, attrs):
+    """This is a private function, not to be called from outside NaElement.
+    Unpickles a copied NaElementView.
+    """
+
+    elt = NaElement(name)
+    elt.__setstate__((name, content, children, attrs))
+    return elt
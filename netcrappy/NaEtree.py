@@ -0,0 +1,152 @@
+#============================================================#
+#                                                            #
+# NaEtree.py                                                 #
+#                                                            #
+# ElementTree based parsing of ONTAPI and DataFabric Manager #
+# responses.                                                 #
+#                                                            #
+#============================================================#
+
+"""
+Response parsers built on the C accelerated xml.etree.ElementTree,
+selected with NaServer.set_parse_backend().
+
+NaEtreeParser builds the document with ElementTree and then gives
+either a tree of ordinary NaElements ('etree' backend) or a tree of
+NaEtreeElements ('etree-view' backend). An NaEtreeElement is an
+NaElement whose name, content, children and attributes are read from
+the ElementTree node underneath when first used, so that the parts of
+a large response that are never looked at are never converted.
+"""
+
+import sys
+
+try:
+    if (sys.version_info[0] < 3):
+        import xml.etree.cElementTree as ElementTree
+    else :
+        import xml.etree.ElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+from .NaElement import NaElement, NaElementView, NAMES, intern_name
+
+
+def strip_namespaces(root):
+    """This is a private function, not to be called from outside NaEtree.
+    Removes the '{namespace}' prefix that ElementTree gives the tags,
+    since NaElement names are plain tag names.
+    """
+
+    if (root.tag[:1] != "{"):
+        return
+    for node in root.iter():
+        tag = node.tag
+        if (tag[:1] == "{"):
+            node.tag = tag[tag.index("}") + 1:]
+
+
+def node_content(node):
+    """This is a private function, not to be called from outside NaEtree.
+    Returns the text of 'node', outside its children, as NaElement
+    content (escaped, as NaResponseParser stores it).
+    """
+
+    text = node.text or ""
+    if (len(node)):
+        text = text + "".join([child.tail or "" for child in node])
+    return NaElement.escapeHTML(text)
+
+
+def node_attrs(node):
+    """This is a private function, not to be called from outside NaEtree.
+    """
+
+    if (not node.attrib):
+        return None
+    attrs = []
+    for (key, value) in node.attrib.items():
+        attrs.append(key)
+        attrs.append(value)
+    return attrs
+
+
+def to_naelement(root, intern_table=None):
+    """Returns the ElementTree node 'root' converted to a tree of
+    NaElements, with the content interned in the
+    NaElement.NaInternTable 'intern_table' if there is one.
+    """
+
+    out = NaElement(intern_name(root.tag))
+    stack = [(root, out)]
+    while stack:
+        (node, elt) = stack.pop()
+        if (node.text or len(node)):
+            elt.content = node_content(node)
+            if (intern_table != None):
+                elt.content = intern_table.intern(elt.name, elt.content)
+        if (node.attrib):
+            elt.attrs = node_attrs(node)
+        if (len(node)):
+            children = elt.children = [NaElement(NAMES.get(child.tag) or intern_name(child.tag))
+                                       for child in node]
+            stack.extend(zip(node, children))
+    return out
+
+
+class NaEtreeElement(NaElementView) :
+    """An NaElement over an ElementTree node, see NaElementView.
+    """
+
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        NaElementView.__init__(self, NAMES.get(node.tag) or intern_name(node.tag))
+        self.node = node
+
+    def read_content(self):
+        return node_content(self.node)
+
+    def read_children(self):
+        node = self.node
+        if (len(node)):
+            return [NaEtreeElement(child) for child in node]
+        return None
+
+    def read_attrs(self):
+        return node_attrs(self.node)
+
+
+class NaEtreeParser :
+    """A response parser with the interface of NaResponseParser, see
+    NaServer.set_parse_backend(). With 'view' True, get_root() returns
+    an NaEtreeElement, otherwise a tree of NaElements whose content is
+    interned in 'intern_table' if there is one.
+    """
+
+    def __init__(self, view=False, intern_table=None):
+        self.view = view
+        self.intern_table = intern_table
+        self.parser = ElementTree.XMLParser()
+        self.root = None
+
+    def feed(self, data, final=0):
+        """Parse the next piece of the document. Pass 'final' as 1
+        with the last piece.
+        """
+
+        if (data):
+            self.parser.feed(data)
+        if (final):
+            self.root = self.parser.close()
+            strip_namespaces(self.root)
+
+    def get_root(self):
+        """Return the document element, or None if there is none.
+        """
+
+        if (self.root == None):
+            return None
+        if (self.view):
+            return NaEtreeElement(self.root)
+        return to_naelement(self.root, self.intern_table)
@@ -0,0 +1,400 @@
+#============================================================#
+#                                                            #
+# NaLazy.py                                                  #
+#                                                            #
+# Lazy parsing of ONTAPI and DataFabric Manager responses.   #
+#                                                            #
+#============================================================#
+
+"""
+The 'lazy' response parse backend, see NaServer.set_parse_backend().
+
+NaLazyParser keeps the raw response (in a bytearray) and returns an NaLazyElement for
+the document element. An NaLazyElement only knows where its start tag
+and content are in the response; its attributes, content and children
+are decoded when they are first used, and each child is again an
+NaLazyElement. The end of an element is found by searching for its
+closing tag (or, if its content holds comments, CDATA sections or
+processing instructions, by reading it tag by tag), so the parts of a
+response that are never looked at are skipped over at the speed of
+bytes.find() and never become Python objects.
+
+Responses are expected in UTF-8, as ONTAPI sends them. Malformed XML
+is only noticed in the parts of the document that are read, and
+raises xml.parsers.expat.ExpatError as the other backends do.
+"""
+
+import re
+import xml.parsers.expat
+
+from .NaElement import NaElement, NaElementView, NOT_READ, intern_name
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+#the characters that may end a tag name
+NAME_END_RE = re.compile(br"[\s/>]")
+
+#an element without children, matched in one go
+LEAF_RE = re.compile(br"<([^\s/<>!?]+)(\s(?:[^<>\"']|\"[^<\"]*\"|'[^<']*')*?)?(?:/>|>([^<]*)</\1\s*>)")
+
+#a quote or the end of a tag
+TAG_PART_RE = re.compile(br"[\"'>]")
+
+ATTR_RE = re.compile(br"([^\s=]+)\s*=\s*(?:\"([^\"]*)\"|'([^']*)')")
+
+REFERENCE_RE = re.compile(r"&(#[xX][0-9a-fA-F]+|#[0-9]+|[A-Za-z]+);")
+
+#the tag names decoded so far, by their UTF-8 bytes
+RAW_NAMES = {}
+
+XML_ENTITIES = {"amp": "&", "lt": "<", "gt": ">", "quot": '"', "apos": "'"}
+
+ATTR_WHITESPACE_RE = re.compile(r"[\t\n]")
+
+
+def parse_error(message, pos):
+    """This is a private function, not to be called from outside NaLazy.
+    """
+
+    return xml.parsers.expat.ExpatError("%s: byte %d" % (message, pos))
+
+
+def replace_reference(match):
+    """This is a private function, not to be called from outside NaLazy.
+    """
+
+    ref = match.group(1)
+    if (ref[0] == "#"):
+        if (ref[1] in "xX"):
+            return unichr(int(ref[2:], 16))
+        return unichr(int(ref[1:]))
+    if (ref not in XML_ENTITIES):
+        raise xml.parsers.expat.ExpatError("undefined entity: &" + ref + ";")
+    return XML_ENTITIES[ref]
+
+
+def decode_name(raw):
+    """This is a private function, not to be called from outside NaLazy.
+    """
+
+    # regular expression groups of a bytearray are bytearrays on Python 2
+    raw = bytes(raw)
+    name = RAW_NAMES.get(raw)
+    if (name == None):
+        name = RAW_NAMES[raw] = intern_name(raw.decode("utf-8"))
+    return name
+
+
+def decode_text(raw):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the character data 'raw' as expat reports it.
+    """
+
+    text = raw.decode("utf-8")
+    if ("\r" in text):
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if ("&" in text):
+        text = REFERENCE_RE.sub(replace_reference, text)
+    return text
+
+
+def decode_attr(raw):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the attribute value 'raw' as expat reports it.
+    """
+
+    text = raw.decode("utf-8")
+    if ("\r" in text):
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if ("\t" in text or "\n" in text):
+        text = ATTR_WHITESPACE_RE.sub(" ", text)
+    if ("&" in text):
+        text = REFERENCE_RE.sub(replace_reference, text)
+    return text
+
+
+def find_tag_end(buf, lt, end):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the position of the '>' ending the tag that starts at 'lt'.
+    """
+
+    gt = buf.find(b">", lt, end)
+    if (gt < 0):
+        raise parse_error("unclosed token", lt)
+    if (buf.find(b'"', lt, gt) < 0 and buf.find(b"'", lt, gt) < 0):
+        return gt
+    # a quoted attribute value may contain '>'
+    pos = lt
+    while True:
+        match = TAG_PART_RE.search(buf, pos, end)
+        if (match == None):
+            raise parse_error("unclosed token", lt)
+        if (match.group() == b">"):
+            return match.start()
+        pos = buf.find(match.group(), match.end(), end)
+        if (pos < 0):
+            raise parse_error("unclosed attribute value", lt)
+        pos = pos + 1
+
+
+def find_close_tag(buf, name, pos, end):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the position of the closing tag of the element 'name' whose
+    content starts at 'pos', allowing for elements of the same name
+    nested in it.
+    """
+
+    try:
+        close = search_close_tag(buf, name, pos, end)
+    except xml.parsers.expat.ExpatError:
+        close = -1
+    if (close < 0 or holds_markup(buf, pos, close)):
+        # tags in comments, CDATA sections and processing instructions
+        # do not count, so the content is read tag by tag
+        return walk_close_tag(buf, name, pos, end)
+    return close
+
+
+def holds_markup(buf, start, end):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns True if a comment, CDATA section, processing instruction
+    or declaration starts between 'start' and 'end'.
+    """
+
+    # '!' and '?' are rare in responses and found much faster than '<!'
+    for mark in (b"<!", b"<?"):
+        pos = buf.find(mark[1:], start, end)
+        if (pos >= 0 and buf.find(mark, max(pos - 1, start), end) >= 0):
+            return True
+    return False
+
+
+def search_close_tag(buf, name, pos, end):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the position of the closing tag of the element 'name', or
+    -1 if there is none, by counting the tags of that name only.
+    """
+
+    open_tag = b"<" + name
+    close_tag = b"</" + name
+    depth = 1
+    while True:
+        close = buf.find(close_tag, pos, end)
+        if (close < 0):
+            return -1
+        nested = buf.find(open_tag, pos, close)
+        while (nested >= 0):
+            after = nested + len(open_tag)
+            if (NAME_END_RE.match(buf, after, after + 1) != None):
+                gt = find_tag_end(buf, nested, close)
+                if (buf[gt - 1:gt] != b"/"):
+                    depth = depth + 1
+            nested = buf.find(open_tag, after, close)
+        after = close + len(close_tag)
+        pos = after
+        if (NAME_END_RE.match(buf, after, after + 1) == None):
+            # the closing tag of an element whose name starts with 'name'
+            continue
+        depth = depth - 1
+        if (depth == 0):
+            return close
+
+
+def walk_close_tag(buf, name, pos, end):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the position of the closing tag of the element 'name',
+    reading every tag, comment, CDATA section and processing
+    instruction of its content.
+    """
+
+    depth = 1
+    while True:
+        lt = buf.find(b"<", pos, end)
+        if (lt < 0):
+            raise parse_error("no closing tag for element '%s'" % decode_name(name), pos)
+        if (buf.startswith(b"<![CDATA[", lt)):
+            stop = buf.find(b"]]>", lt, end)
+            if (stop < 0):
+                raise parse_error("unclosed CDATA section", lt)
+            pos = stop + 3
+        elif (buf.startswith(b"<!", lt) or buf.startswith(b"<?", lt)):
+            pos = skip_markup(buf, lt, end)
+        elif (buf.startswith(b"</", lt)):
+            depth = depth - 1
+            if (depth == 0):
+                after = lt + 2 + len(name)
+                if (buf[lt + 2:after] != name or NAME_END_RE.match(buf, after, after + 1) == None):
+                    raise parse_error("mismatched tag", lt)
+                return lt
+            pos = find_tag_end(buf, lt, end) + 1
+        else :
+            gt = find_tag_end(buf, lt, end)
+            if (buf[gt - 1:gt] != b"/"):
+                depth = depth + 1
+            pos = gt + 1
+
+
+def skip_markup(buf, lt, end):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the position after the comment, processing instruction or
+    declaration starting at 'lt'.
+    """
+
+    if (buf.startswith(b"<!--", lt)):
+        terminator = b"-->"
+    elif (buf.startswith(b"<?", lt)):
+        terminator = b"?>"
+    else :
+        terminator = b">"
+    stop = buf.find(terminator, lt, end)
+    if (stop < 0):
+        raise parse_error("unclosed token", lt)
+    return stop + len(terminator)
+
+
+def element_at(buf, lt, end):
+    """This is a private function, not to be called from outside NaLazy.
+    Returns the element whose start tag is at 'lt' and the position
+    after its end.
+    """
+
+    gt = find_tag_end(buf, lt, end)
+    name_end = NAME_END_RE.search(buf, lt + 1, gt + 1).start()
+    name = buf[lt + 1:name_end]
+    if (not name):
+        raise parse_error("not well-formed", lt)
+    if (buf[gt - 1:gt] == b"/"):
+        return (NaLazyElement(buf, name, name_end, gt - 1, gt + 1, gt + 1), gt + 1)
+    close = find_close_tag(buf, name, gt + 1, end)
+    close_end = buf.find(b">", close, end)
+    return (NaLazyElement(buf, name, name_end, gt, gt + 1, close), close_end + 1)
+
+
+class NaLazyElement(NaElementView) :
+    """An NaElement over its part of a raw response, see NaLazy and
+    NaElementView.
+    """
+
+    __slots__ = ('buf', 'attr_start', 'attr_end', 'start', 'end')
+
+    def __init__(self, buf, name, attr_start, attr_end, start, end):
+        NaElementView.__init__(self, decode_name(name))
+        self.buf = buf
+        self.attr_start = attr_start
+        self.attr_end = attr_end
+        self.start = start
+        self.end = end
+
+    def read_content(self):
+        buf = self.buf
+        if (buf.find(b"<", self.start, self.end) < 0):
+            return NaElement.escapeHTML(decode_text(buf[self.start:self.end]))
+        self.scan()
+        return self.view_content
+
+    def read_children(self):
+        if (self.buf.find(b"<", self.start, self.end) < 0):
+            return None
+        (content, children) = self.scan()
+        return children
+
+    def read_attrs(self):
+        if (self.attr_start == self.attr_end):
+            return None
+        attrs = []
+        for match in ATTR_RE.finditer(self.buf, self.attr_start, self.attr_end):
+            attrs.append(match.group(1).decode("utf-8"))
+            value = match.group(2)
+            if (value == None):
+                value = match.group(3)
+            attrs.append(decode_attr(value))
+        return attrs or None
+
+    def scan(self):
+        """This is a private function, not to be called from outside NaLazyElement.
+        Finds the children and the text of the element, and stores
+        whichever of them have not been read or set yet.
+        """
+
+        buf = self.buf
+        pos = self.start
+        end = self.end
+        children = []
+        text = []
+        while (pos < end):
+            lt = buf.find(b"<", pos, end)
+            if (lt < 0):
+                text.append(decode_text(buf[pos:end]))
+                break
+            if (lt > pos):
+                text.append(decode_text(buf[pos:lt]))
+            leaf = LEAF_RE.match(buf, lt, end)
+            if (leaf != None):
+                pos = leaf.end()
+                if (leaf.start(3) < 0):
+                    children.append(NaLazyElement(buf, leaf.group(1), leaf.start(2), leaf.end(2), pos, pos))
+                else :
+                    children.append(NaLazyElement(buf, leaf.group(1), leaf.start(2), leaf.end(2), leaf.start(3), leaf.end(3)))
+            elif (buf.startswith(b"<![CDATA[", lt)):
+                stop = buf.find(b"]]>", lt, end)
+                if (stop < 0):
+                    raise parse_error("unclosed CDATA section", lt)
+                text.append(buf[lt + 9:stop].decode("utf-8").replace("\r\n", "\n"))
+                pos = stop + 3
+            elif (buf.startswith(b"<!", lt) or buf.startswith(b"<?", lt)):
+                pos = skip_markup(buf, lt, end)
+            elif (buf.startswith(b"</", lt)):
+                raise parse_error("mismatched tag", lt)
+            else :
+                (child, pos) = element_at(buf, lt, end)
+                children.append(child)
+        content = NaElement.escapeHTML("".join(text))
+        children = children or None
+        if (self.view_content is NOT_READ):
+            self.view_content = content
+        if (self.view_children is NOT_READ):
+            self.view_children = children
+        return (content, children)
+
+
+class NaLazyParser :
+    """A response parser with the interface of NaResponseParser that
+    only collects the response; get_root() returns an NaLazyElement.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.done = False
+
+    def feed(self, data, final=0):
+        """Take the next piece of the document. Pass 'final' as 1
+        with the last piece.
+        """
+
+        if (data):
+            self.buf += data
+        if (final):
+            self.done = True
+            if (self.buf.find(b"<") < 0):
+                raise parse_error("no element found", len(self.buf))
+
+    def get_root(self):
+        """Return the document element, or None if there is none.
+        """
+
+        buf = self.buf
+        if (not self.done):
+            return None
+        end = len(buf)
+        pos = 0
+        while True:
+            lt = buf.find(b"<", pos)
+            if (lt < 0):
+                return None
+            if (buf.startswith(b"<!", lt) or buf.startswith(b"<?", lt)):
+                pos = skip_markup(buf, lt, end)
+            else :
+                return element_at(buf, lt, end)[0]
@@ -0,0 +1,174 @@
+#============================================================#
+#                                                            #
+# NaMetrics.py                                               #
+#                                                            #
+# Per-API call metrics of ONTAPI and DataFabric Manager      #
+# servers.                                                   #
+#                                                            #
+#============================================================#
+
+"""
+Metrics kept by NaServer for every call.
+
+Each NaServer records its calls in a metrics registry, by default the
+shared DEFAULT_REGISTRY, under the server name and API name: the
+number of calls, the number of failures per errno, the latency
+distribution and the bytes sent and received. Latencies go into
+logarithmic buckets, 16 per factor of 10, so that percentiles are
+accurate to about 15% whatever the number of calls.
+"""
+
+import math
+import threading
+
+#latencies below this (in seconds) share the first bucket
+LATENCY_FLOOR = 0.00001
+
+BUCKETS_PER_DECADE = 16
+BUCKET_SCALE = BUCKETS_PER_DECADE / math.log(10)
+
+PERCENTILES = (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))
+
+
+class NaApiMetrics :
+    """Metrics of one API on one server, see NaMetricsRegistry.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = {}
+        self.buckets = {}
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def record(self, latency, errno, request_bytes, response_bytes):
+        """This is a private function, not to be called from outside NaMetricsRegistry
+        """
+
+        self.count += 1
+        if (errno != 0):
+            self.errors[errno] = self.errors.get(errno, 0) + 1
+        if (latency > LATENCY_FLOOR):
+            bucket = int(math.log(latency / LATENCY_FLOOR) * BUCKET_SCALE)
+        else :
+            bucket = 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.total_latency += latency
+        if (latency > self.max_latency):
+            self.max_latency = latency
+        self.request_bytes += request_bytes
+        self.response_bytes += response_bytes
+
+    def percentile(self, fraction):
+        """Returns the latency (in seconds) that 'fraction' of the calls
+    did not exceed, as the upper bound of its bucket.
+    """
+
+        if (self.count == 0):
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if (seen >= rank):
+                break
+        upper = LATENCY_FLOOR * math.exp((bucket + 1) / BUCKET_SCALE)
+        return min(upper, self.max_latency)
+
+    def to_dict(self):
+        """Returns the metrics as a dictionary of plain values.
+        """
+
+        out = {"count": self.count,
+               "errors": dict(self.errors),
+               "error_count": sum(self.errors.values()),
+               "mean": None,
+               "max": self.max_latency,
+               "request_bytes": self.request_bytes,
+               "response_bytes": self.response_bytes}
+        if (self.count > 0):
+            out["mean"] = self.total_latency / self.count
+        for (name, fraction) in PERCENTILES:
+            out[name] = self.percentile(fraction)
+        return out
+
+
+class NaMetricsRegistry :
+    """Thread-safe collection of NaApiMetrics keyed by server and API
+    name. A registry may be shared by any number of NaServers.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        # shared by copies of an NaServer (see Cluster.vserver())
+        return self
+
+    def record(self, server, api, latency, errno=0, request_bytes=0, response_bytes=0):
+        """Records a call of 'api' on 'server' that took 'latency'
+    seconds and failed with 'errno' unless it is 0.
+    """
+
+        key = (server, api)
+        self.lock.acquire()
+        try:
+            metrics = self.metrics.get(key)
+            if (metrics == None):
+                metrics = self.metrics[key] = NaApiMetrics()
+            metrics.record(latency, errno, request_bytes, response_bytes)
+        finally:
+            self.lock.release()
+
+    def get(self, server, api):
+        """Returns the metrics of 'api' on 'server' as a dictionary
+    (see snapshot()), or None if it has not been called.
+    """
+
+        self.lock.acquire()
+        try:
+            metrics = self.metrics.get((server, api))
+            if (metrics == None):
+                return None
+            return metrics.to_dict()
+        finally:
+            self.lock.release()
+
+    def snapshot(self, server=None):
+        """Returns a list with a dictionary per server and API, sorted
+    by server and API, optionally only for 'server'. Each has the
+    keys 'server', 'api', 'count', 'error_count', 'errors' (the
+    number of failures by errno), 'mean', 'max', 'p50', 'p95' and
+    'p99' (latencies in seconds) and 'request_bytes' and
+    'response_bytes'.
+    """
+
+        self.lock.acquire()
+        try:
+            out = []
+            for key in sorted(self.metrics):
+                if (server != None and key[0] != server):
+                    continue
+                entry = self.metrics[key].to_dict()
+                entry["server"] = key[0]
+                entry["api"] = key[1]
+                out.append(entry)
+            return out
+        finally:
+            self.lock.release()
+
+    def reset(self):
+        """Forgets all metrics.
+        """
+
+        self.lock.acquire()
+        try:
+            self.metrics = {}
+        finally:
+            self.lock.release()
+
+
+DEFAULT_REGISTRY = NaMetricsRegistry()
@@ -0,0 +1,258 @@
+#============================================================#
+#                                                            #
+# NaPath.py                                                  #
+#                                                            #
+# Compiled path queries over NaElement records.              #
+#                                                            #
+#============================================================#
+
+"""
+Path queries for picking fields out of the records of an API's output,
+see select() and NaElement.select().
+
+A path names a descendant of a record by the names of the elements
+leading to it, separated by '/', and may end in a suffix telling how
+to return its value:
+
+  volume-id-attributes/name              the content, as a string
+  volume-space-attributes/size-used:int  the content, as an integer
+  volume-sis-attributes/is-sis-volume:bool
+                                         True if the content is 'true'
+  allowed-protocols:element              the element itself
+
+A record without the element gives None. For columns that aggregate
+well, see NaColumns and select_columns(). A set of paths is compiled
+once into a Python function (as collections.namedtuple() builds its
+classes) and cached, so that selecting from many records does nothing
+but walk the elements.
+"""
+
+import array
+import threading
+
+#path suffixes and the expression for the value of the element found
+CONVERSIONS = {
+    "string": "%s.content",
+    "int": "int(%s.content)",
+    "bool": "%s.content == 'true'",
+    "element": "%s",
+}
+
+#array type code of 64 bit integers, which Python 2 only has as "l"
+try:
+    INT64_CODE = array.array("q").typecode
+except ValueError:
+    INT64_CODE = "l"
+
+#array type codes of the NaColumns columns of each path type; the
+#others are lists
+ARRAY_CODES = {"int": INT64_CODE, "bool": "b"}
+
+#NumPy types of the array columns
+NUMPY_TYPES = {"int": "int64", "bool": "bool"}
+
+#compiled paths and selectors, by path and tuple of paths
+PATHS = {}
+SELECTORS = {}
+CACHE_LOCK = threading.Lock()
+
+
+class NaPath :
+    """A parsed path, see NaPath and compile_path().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        (spec, sep, kind) = path.partition(":")
+        if (not sep):
+            kind = "string"
+        if (kind not in CONVERSIONS):
+            raise ValueError("NaPath: invalid type '" + kind + "' in path " + path)
+        self.steps = tuple(spec.split("/"))
+        if ("" in self.steps):
+            raise ValueError("NaPath: invalid path " + path)
+        self.kind = kind
+
+
+class NaSelector :
+    """A compiled set of paths, see compile_selector(). Paths sharing a
+    prefix look up the elements of the prefix once per record.
+    """
+
+    def __init__(self, paths):
+        self.paths = tuple([compile_path(path) for path in paths])
+        # the plan is a list of steps [name, ends, plan, columns]: the
+        # paths ending at the step as (column, kind), the steps below
+        # it, and the columns of all the paths through it
+        self.plan = []
+        for (column, path) in enumerate(self.paths):
+            plan = self.plan
+            for (i, name) in enumerate(path.steps):
+                for step in plan:
+                    if (step[0] == name):
+                        break
+                else :
+                    step = [name, [], [], []]
+                    plan.append(step)
+                step[3].append(column)
+                if (i == len(path.steps) - 1):
+                    step[1].append((column, path.kind))
+                plan = step[2]
+        appends = "".join([", c%d" % column for column in range(len(self.paths))])
+        self.source = ["def select(records%s):" % appends,
+                       "    for elt0 in records:"]
+        self.emit(self.plan, 1)
+        self.source.append("        pass")
+        self.source = "\n".join(self.source) + "\n"
+        namespace = {}
+        exec(compile(self.source, "<NaSelector>", "exec"), namespace)
+        self.function = namespace["select"]
+
+    def emit(self, plan, depth):
+        """This is a private function, not to be called from outside NaSelector.
+        Appends the source looking up the steps of 'plan' in the
+        element elt<depth - 1>.
+        """
+
+        indent = "    " * (depth + 1)
+        elt = "elt%d" % depth
+        for (name, ends, steps, columns) in plan:
+            self.source.append("%s%s = elt%d.child_get(%r)" % (indent, elt, depth - 1, name))
+            self.source.append("%sif (%s == None):" % (indent, elt))
+            for column in columns:
+                self.source.append("%s    c%d(None)" % (indent, column))
+            self.source.append("%selse :" % indent)
+            for (column, kind) in ends:
+                self.source.append("%s    c%d(%s)" % (indent, column, CONVERSIONS[kind] % elt))
+            self.emit(steps, depth + 1)
+            self.source.append("%s    pass" % indent)
+
+    def select(self, records):
+        """Returns a list of columns, one per path, with the value of
+        the path in each of 'records'.
+        """
+
+        columns = [[] for path in self.paths]
+        self.function(records, *[column.append for column in columns])
+        return columns
+
+
+def compile_path(path):
+    """Returns the NaPath of 'path', from the cache if it has been
+    compiled before. Raises ValueError for an invalid path.
+    """
+
+    compiled = PATHS.get(path)
+    if (compiled == None):
+        compiled = NaPath(path)
+        CACHE_LOCK.acquire()
+        try:
+            compiled = PATHS.setdefault(path, compiled)
+        finally:
+            CACHE_LOCK.release()
+    return compiled
+
+
+def compile_selector(paths):
+    """Returns the NaSelector of the sequence 'paths', from the cache
+    if it has been compiled before.
+    """
+
+    paths = tuple(paths)
+    selector = SELECTORS.get(paths)
+    if (selector == None):
+        selector = NaSelector(paths)
+        CACHE_LOCK.acquire()
+        try:
+            selector = SELECTORS.setdefault(paths, selector)
+        finally:
+            CACHE_LOCK.release()
+    return selector
+
+
+def select(records, *paths):
+    """Returns a list of columns, one per path in 'paths', with the
+    value of the path in each of the NaElements 'records'. For example
+        (names, used) = select(volumes, 'volume-id-attributes/name',
+                               'volume-space-attributes/size-used:int')
+    """
+
+    return compile_selector(paths).select(records)
+
+
+class NaColumns :
+    """Accumulates the values of 'paths' in the records given to add(),
+    one column per path, for the reports that sum or filter a field
+    over many records. The ':int' columns are 64 bit arrays and the
+    ':bool' columns array('b'), with 0 for the records without the
+    element, and the others are lists. For example
+        columns = NaColumns(['volume-id-attributes/containing-aggregate-name',
+                             'volume-space-attributes/size-used:int'])
+        columns.add(volumes)
+        used = sum(columns['volume-space-attributes/size-used'])
+    """
+
+    def __init__(self, paths):
+        self.selector = compile_selector(paths)
+        self.columns = {}
+        for path in self.selector.paths:
+            code = ARRAY_CODES.get(path.kind)
+            if (code == None):
+                self.columns[path.path.partition(":")[0]] = []
+            else :
+                self.columns[path.path.partition(":")[0]] = array.array(code)
+
+    def add(self, records):
+        """Appends the values of the paths in each of 'records' to the
+        columns.
+        """
+
+        values = self.selector.select(records)
+        for (path, column) in zip(self.selector.paths, values):
+            if (path.kind in ARRAY_CODES and None in column):
+                column = [value or 0 for value in column]
+            self.columns[path.path.partition(":")[0]].extend(column)
+
+    def __getitem__(self, path):
+        """Returns the column of 'path', given without its type.
+        """
+
+        return self.columns[path]
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def keys(self):
+        return list(self.columns)
+
+    def to_dict(self, numpy=False):
+        """Returns a dictionary of the columns by path, without the
+        type. With 'numpy' True the array columns are NumPy arrays
+        sharing the memory of the arrays, which therefore cannot grow:
+        add() raises BufferError while the NumPy arrays exist.
+        """
+
+        if (not numpy):
+            return dict(self.columns)
+        import numpy
+        out = {}
+        for path in self.selector.paths:
+            key = path.path.partition(":")[0]
+            column = self.columns[key]
+            if (path.kind in NUMPY_TYPES):
+                column = numpy.frombuffer(column, dtype=NUMPY_TYPES[path.kind])
+            out[key] = column
+        return out
+
+
+def select_columns(records, paths, numpy=False):
+    """Returns a dictionary of the columns of 'paths' in 'records' by
+    path, without the type, see NaColumns.
+    """
+
+    columns = NaColumns(paths)
+    columns.add(records)
+    return columns.to_dict(numpy)
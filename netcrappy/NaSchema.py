@@ -0,0 +1,209 @@
+#============================================================#
+#                                                            #
+# NaSchema.py                                                #
+#                                                            #
+# Compiled extractors for api_recurse() schemas.             #
+#                                                            #
+#============================================================#
+
+"""
+Compiles the schema dictionaries of Filer.api_recurse() into Python
+functions, so that extracting a record does not interpret the schema
+again. For example
+    extract = compile_schema(AGGR_LIST_INFO)
+    aggrs = extract(out)['aggregates']
+
+A schema maps element names to 'string', 'integer' or 'boolean', or to
+a nested schema with an 'is_list' key: True for an element whose
+children are records of the nested schema, False (the default) for a
+single nested element. The extractor returns the dictionary that
+api_recurse() returns, with None for the elements a record does not
+have ('boolean' gives False, as 'true' is missing). Keys of any other
+value are left out, as api_recurse() leaves them out.
+
+schema_paths() turns a schema without lists into NaPath paths, for
+the columnar results of NaPath.NaColumns, and desired_attributes()
+turns a schema or paths into the 'desired-attributes' of an iter API
+call, so that the server only sends the values that are read.
+
+Compiled extractors are cached by the identity of the schema, which
+should therefore be a constant that is not changed after its first
+use.
+"""
+
+import threading
+
+from .NaElement import NaElement
+
+#value types and the expression for the value of the element found
+CONVERSIONS = {
+    "string": "%s.content",
+    "integer": "int(%s.content)",
+}
+
+#NaPath types of the value types
+PATH_TYPES = {"string": "", "integer": ":int", "boolean": ":bool"}
+
+#schemas with this many keys use the child index of wide elements
+INDEX_MIN_KEYS = 4
+
+#compiled extractors by id() of their schema, as (schema, extractor)
+EXTRACTORS = {}
+MAX_EXTRACTORS = 256
+CACHE_LOCK = threading.Lock()
+
+
+class NaSchemaCompiler :
+    """Writes the source of the extractor of a schema, one function
+    per nested schema. This is a private class, not to be used from
+    outside NaSchema.
+    """
+
+    def __init__(self):
+        self.source = []
+        self.count = 0
+
+    def compile(self, schema):
+        """Returns the extractor function of 'schema'.
+        """
+
+        self.function(schema)
+        namespace = {}
+        exec(compile("\n".join(self.source) + "\n", "<NaSchema>", "exec"), namespace)
+        return namespace["extract_0"]
+
+    def function(self, schema):
+        """Appends the source of the function of 'schema' and of its
+        nested schemas, and returns its name.
+        """
+
+        name = "extract_%d" % self.count
+        self.count = self.count + 1
+        lines = ["def %s(elt):" % name]
+        if (len(schema) >= INDEX_MIN_KEYS):
+            # look the children up in the index of a wide element
+            lines.append("    children = elt.children")
+            lines.append("    if (children != None and len(children) >= elt.INDEX_MIN_CHILDREN):")
+            lines.append("        child_get = elt.get_index().get")
+            lines.append("    else :")
+            lines.append("        child_get = elt.child_get")
+        else :
+            lines.append("    child_get = elt.child_get")
+        keys = []
+        for (key, value) in schema.items():
+            if (isinstance(value, dict)):
+                nested = self.function(value)
+                lines.append("    child = child_get(%r)" % key)
+                if (value.get("is_list", False)):
+                    expression = "[%s(item) for item in child.children_get()]" % nested
+                else :
+                    expression = "%s(child)" % nested
+                lines.append("    v%d = None if child == None else %s" % (len(keys), expression))
+            elif (value in CONVERSIONS):
+                lines.append("    child = child_get(%r)" % key)
+                lines.append("    v%d = None if child == None else %s"
+                             % (len(keys), CONVERSIONS[value] % "child"))
+            elif (value == "boolean"):
+                lines.append("    child = child_get(%r)" % key)
+                lines.append("    v%d = child != None and child.content == 'true'" % len(keys))
+            else :
+                continue
+            keys.append(key)
+        items = ", ".join(["%r: v%d" % (key, i) for (i, key) in enumerate(keys)])
+        lines.append("    return {%s}" % items)
+        self.source.extend(lines)
+        return name
+
+
+def schema_paths(schema, prefix=""):
+    """Returns the NaPath paths of the values of 'schema', for
+    example 'aggr-space-attributes/size-used:int'. Raises ValueError
+    if the schema has a list, which has no column.
+    """
+
+    paths = []
+    for (key, value) in schema.items():
+        if (isinstance(value, dict)):
+            if (value.get("is_list", False)):
+                raise ValueError("NaSchema::schema_paths: list " + prefix + key + " cannot be a column")
+            paths.extend(schema_paths(value, prefix + key + "/"))
+        elif (value in PATH_TYPES):
+            paths.append(prefix + key + PATH_TYPES[value])
+    return paths
+
+
+def attributes_tree(fields):
+    """This is a private function, not to be called from outside NaSchema.
+    Returns the elements named by the schema or paths 'fields' as a
+    dictionary of their children by name, None for an element wanted
+    as a whole.
+    """
+
+    tree = {}
+    if (isinstance(fields, dict)):
+        for (key, value) in fields.items():
+            if (isinstance(value, dict)):
+                if (value.get("is_list", False)):
+                    # the schema does not name the elements of the list
+                    tree[key] = None
+                else :
+                    tree[key] = attributes_tree(value)
+            elif (value in PATH_TYPES):
+                tree[key] = None
+        return tree
+    for path in fields:
+        (spec, sep, kind) = path.partition(":")
+        steps = spec.split("/")
+        node = tree
+        for name in steps[:-1]:
+            if (name in node and node[name] == None):
+                break
+            node = node.setdefault(name, {})
+        else :
+            node[steps[-1]] = None
+    return tree
+
+
+def attributes_element(name, tree):
+    """This is a private function, not to be called from outside NaSchema.
+    """
+
+    elt = NaElement(name)
+    if (tree != None):
+        for key in sorted(tree):
+            elt.child_add(attributes_element(key, tree[key]))
+    return elt
+
+
+def desired_attributes(record, fields):
+    """Returns the 'desired-attributes' element of an iter API call
+    asking only for the values of 'fields', an api_recurse() schema or
+    a sequence of NaPath paths, in the records named 'record' (such as
+    'volume-attributes'). Lists and ':element' paths are asked for as
+    a whole, as the schema does not name the elements in them.
+    """
+
+    desired = NaElement("desired-attributes")
+    desired.child_add(attributes_element(record, attributes_tree(fields)))
+    return desired
+
+
+def compile_schema(schema):
+    """Returns the extractor function of the api_recurse() schema
+    'schema', from the cache if it has been compiled before.
+    """
+
+    entry = EXTRACTORS.get(id(schema))
+    if (entry != None and entry[0] is schema):
+        return entry[1]
+    extractor = NaSchemaCompiler().compile(schema)
+    CACHE_LOCK.acquire()
+    try:
+        if (len(EXTRACTORS) >= MAX_EXTRACTORS):
+            # schemas built on every call would fill the cache
+            EXTRACTORS.clear()
+        # the schema is kept so that its id() is not reused
+        EXTRACTORS[id(schema)] = (schema, extractor)
+    finally:
+        CACHE_LOCK.release()
+    return extractor
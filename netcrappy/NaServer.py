@@ -13,11 +13,18 @@
 
 __version__ = "1.0"
 
-from NaElement import *
+from .NaElement import *
+from .NaTrace import NULL_TRACER, clock
+from .NaMetrics import DEFAULT_REGISTRY
 
 import base64
+import copy
+import errno
 import xml.parsers.expat
 import socket
+import threading
+import time
+import zlib
 
 ssl_import = True
 try:
@@ -29,6 +36,13 @@ except ImportError:
 
 python_version = float(str(sys.version_info[0]) + "." + str(sys.version_info[1]))
 
+#SSLContext (Python 2.7.9 and later) allows one TLS configuration to be
+#shared by all connections of an NaServer
+ssl_context_attr = (ssl_import and hasattr(ssl, "SSLContext"))
+
+#sessions can be resumed from Python 3.6 on
+ssl_session_attr = (ssl_context_attr and hasattr(ssl.SSLSocket, "session"))
+
 socket_ssl_attr = True
 if(python_version < 3.0):
     import httplib
@@ -55,6 +69,319 @@ NMSDK_VERSION = "5.2"
 NMSDK_LANGUAGE = "Python"
 nmsdk_app_name = ""
 
+#size of the pieces in which responses are read and parsed
+READ_CHUNK_SIZE = 65536
+
+#content codings understood in responses when compression is enabled
+ACCEPT_ENCODING = "gzip, deflate"
+
+#response parsers selectable with NaServer.set_parse_backend()
+PARSE_BACKENDS = ("expat", "etree", "etree-view", "lazy")
+
+#statuses of a compressed request whose content coding was not accepted
+REJECTED_ENCODING_STATUSES = (400, 415)
+
+#socket errors of a pooled connection that the server has closed
+STALE_CONNECTION_ERRNOS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+#connection pool defaults
+DEFAULT_POOL_SIZE = 4
+DEFAULT_POOL_IDLE_TIMEOUT = 60
+
+
+class NaConnectionPool :
+    """Pool of idle HTTP/1.1 keep-alive connections to a single server.
+
+    NaServer takes a connection from the pool before each call and
+    hands it back once the response has been read completely, so that
+    consecutive calls skip the TCP setup and TLS handshake. Connections
+    idle for longer than 'idle_timeout' seconds are closed instead of
+    being reused. A pool of size 0 never keeps connections, which gives
+    the classic one-connection-per-call behaviour.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.reconnects = 0
+        self.resumed = 0
+
+
+
+    def __deepcopy__(self, memo):
+        """Copies of an NaServer get their own, empty, pool.
+        """
+
+        return NaConnectionPool(self.size, self.idle_timeout)
+
+
+
+    def get(self):
+        """Return an idle connection, or None if a new one has to be opened.
+        """
+
+        now = time.time()
+        self.lock.acquire()
+        try:
+            while(len(self.idle) > 0):
+                (connection, last_used) = self.idle.pop()
+                if(now - last_used > self.idle_timeout):
+                    self.expired = self.expired + 1
+                    connection.close()
+                    continue
+                self.hits = self.hits + 1
+                return connection
+            self.misses = self.misses + 1
+            return None
+        finally:
+            self.lock.release()
+
+
+
+    def put(self, connection):
+        """Give a connection back to the pool once its response has been
+        read. The connection is closed if the pool is full.
+        """
+
+        self.lock.acquire()
+        try:
+            if(len(self.idle) < self.size):
+                self.idle.append((connection, time.time()))
+                return
+        finally:
+            self.lock.release()
+        connection.close()
+
+
+
+    def resumed_session(self):
+        """Record that a new connection resumed an earlier TLS session.
+        """
+
+        self.lock.acquire()
+        self.resumed = self.resumed + 1
+        self.lock.release()
+
+
+
+    def reconnected(self):
+        """Record that a pooled connection had been dropped by the server.
+        """
+
+        self.lock.acquire()
+        self.reconnects = self.reconnects + 1
+        self.lock.release()
+
+
+
+    def clear(self):
+        """Close all idle connections.
+        """
+
+        self.lock.acquire()
+        try:
+            idle = self.idle
+            self.idle = []
+        finally:
+            self.lock.release()
+        for (connection, last_used) in idle:
+            connection.close()
+
+
+
+    def get_stats(self):
+        """Return the pool statistics as a dictionary.
+        """
+
+        self.lock.acquire()
+        try:
+            return {'size': self.size,
+                    'idle_timeout': self.idle_timeout,
+                    'idle': len(self.idle),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'expired': self.expired,
+                    'reconnects': self.reconnects,
+                    'tls_resumed': self.resumed}
+        finally:
+            self.lock.release()
+
+
+def is_stale_connection_error(error):
+    """This is a private function, not to be called from outside NaServer.
+    Returns True if 'error', raised while sending a request on a pooled
+    connection or waiting for the status line of its response, means
+    that the server had closed the connection before the request came,
+    so that sending it again on another connection is safe. A timeout
+    never is: the server may still be working on the request.
+    """
+
+    if (isinstance(error, socket.timeout)):
+        return False
+    if (isinstance(error, httplib.BadStatusLine)):
+        # no status line: the connection was closed (RemoteDisconnected)
+        return True
+    return (getattr(error, "errno", None) in STALE_CONNECTION_ERRNOS)
+
+
+
+class NaResponseParser :
+    """Builds the NaElement tree of one XML document from expat callbacks.
+
+    All parse state lives in the parser rather than in the NaServer,
+    and a new parser is used for every response, so that several
+    threads can invoke APIs through one NaServer at the same time.
+    """
+
+    def __init__(self, intern_table=None):
+        self.ZAPI_stack = []
+        self.ZAPI_atts = {}
+        # the text fragments of each open element, None until there is text
+        self.ZAPI_text = []
+        self.intern_table = intern_table
+        # expat interns the tag and attribute names in NAMES
+        self.parser = xml.parsers.expat.ParserCreate(intern=NAMES)
+        # deliver runs of text in as few pieces as possible
+        self.parser.buffer_text = True
+        self.parser.buffer_size = READ_CHUNK_SIZE
+        self.parser.StartElementHandler = self.start_element
+        self.parser.EndElementHandler = self.end_element
+        self.parser.CharacterDataHandler = self.char_data
+
+
+
+    def feed(self, data, final=0):
+        """Parse the next piece of the document. Pass 'final' as 1
+        with the last piece.
+        """
+
+        self.parser.Parse(data, final)
+
+
+
+    def get_root(self):
+        """Return the document element, or None if there is none.
+        """
+
+        stack_len = len(self.ZAPI_stack)
+
+        if(stack_len <= 0):
+            return None
+
+        return self.ZAPI_stack[0]
+
+
+
+    def start_element(self, name, attrs):
+        """This is a private function, not to be called from outside NaResponseParser
+        """
+
+        n = NaElement(name)
+        self.ZAPI_stack.append(n)
+        self.ZAPI_text.append(None)
+        self.ZAPI_atts = {}
+        attr_name = list(attrs.keys())
+        attr_value = list(attrs.values())
+        i = 0
+        for att in attr_name :
+            val = attr_value[i]
+            i = i+1
+            self.ZAPI_atts[att] = val
+            n.attr_set(att,val)
+
+
+
+    def end_element(self, name):
+        """This is a private function, not to be called from outside NaResponseParser
+        """
+
+        # the text is joined and escaped once, when the element is complete
+        text = self.ZAPI_text.pop()
+        if (text != None):
+            content = NaElement.escapeHTML("".join(text))
+            if (self.intern_table != None):
+                content = self.intern_table.intern(name, content)
+            self.ZAPI_stack[-1].content = content
+
+        stack_len = len(self.ZAPI_stack)
+
+        if (stack_len > 1):
+            n = self.ZAPI_stack.pop(stack_len - 1)
+            i = len(self.ZAPI_stack)
+
+            if(i != stack_len - 1):
+                print("pop did not work!!!!\n")
+
+            self.ZAPI_stack[i-1].child_add(n)
+
+
+
+    def char_data(self, data):
+        """This is a private function, not to be called from outside NaResponseParser
+        """
+
+        text = self.ZAPI_text[-1]
+        if (text == None):
+            self.ZAPI_text[-1] = [data]
+        else :
+            text.append(data)
+
+
+
+class NaDecompressingParser :
+    """Decompresses a gzip or deflate coded response body on the fly
+    and passes the XML on to the wrapped parser.
+    """
+
+    def __init__(self, parser, encoding):
+        self.parser = parser
+        if(encoding == "gzip" or encoding == "x-gzip"):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else :
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+
+
+
+    def feed(self, data, final=0):
+        """Decompress and parse the next piece of the body.
+        """
+
+        data = self.decompressor.decompress(data)
+        if(final):
+            data = data + self.decompressor.flush()
+        self.parser.feed(data, final)
+
+
+
+    def get_root(self):
+        """Return the document element, or None if there is none.
+        """
+
+        return self.parser.get_root()
+
+
+
+def get_response_parser(encoding, p=None):
+    """Returns a parser for a response body with the given
+    Content-Encoding, which may be None. The body is parsed by 'p',
+    by default a new NaResponseParser.
+    """
+
+    if(p == None):
+        p = NaResponseParser()
+    if(encoding != None):
+        encoding = encoding.strip().lower()
+        if(encoding in ("gzip", "x-gzip", "deflate")):
+            p = NaDecompressingParser(p, encoding)
+    return p
+
+
+
 class NaServer :
     """Class for managing Network Appliance(r) Storage System
     using ONTAPI(tm) and DataFabric Manager API(tm).
@@ -105,8 +432,35 @@ class NaServer :
         self.need_cn_verification = False
         self.url = FILER_URL
         self.dtd = FILER_dtd
-        self.ZAPI_stack = []
-        self.ZAPI_atts = {}
+        self.pool = NaConnectionPool()
+        self.tracer = NULL_TRACER
+        self.parse_backend = "expat"
+        self.intern_table = None
+        self.metrics = DEFAULT_REGISTRY
+        self.compression = False
+        self.request_compression_min_size = None
+        self.request_compression_supported = True
+        self.request_prefixes = {}
+        self.update_authheader()
+        self.ssl_context = None
+        self.ssl_session = None
+
+
+
+    def __deepcopy__(self, memo):
+        """Copies of an NaServer (see Cluster.vserver()) share its
+    SSLContext, which cannot be copied, but not its TLS session.
+    """
+
+        clone = copy.copy(self)
+        memo[id(self)] = clone
+        for (key, value) in self.__dict__.items():
+            if (key == "ssl_session"):
+                value = None
+            elif (key != "ssl_context"):
+                value = copy.deepcopy(value, memo)
+            setattr(clone, key, value)
+        return clone
 
 
 
@@ -145,6 +499,7 @@ class NaServer :
             self.need_cba = False
             self.set_server_cert_verification(False)
         self.style = style
+        self.update_authheader()
         return None
 
 
@@ -164,6 +519,7 @@ class NaServer :
 
         self.user = user
         self.password = password
+        self.update_authheader()
 
 
 
@@ -208,6 +564,8 @@ class NaServer :
             return self.fail_response(13001,"in NaServer::set_server_type: bad type \""+server_type+"\"")
 
         self.server_type = server_type
+        self.request_prefixes = {}
+        self.pool.clear()
         return None
 
 
@@ -228,6 +586,7 @@ class NaServer :
 
         if(self.major_version >= 1 and self.minor_version >= 15):
             self.vfiler = vserver
+            self.request_prefixes = {}
             return 1
 
         print("\nONTAPI version must be at least 1.15 to send API to a vserver\n")
@@ -249,6 +608,7 @@ class NaServer :
         """
 
         self.originator_id = originator_id
+        self.request_prefixes = {}
         return 1
 
 
@@ -294,6 +654,7 @@ class NaServer :
             else :
                 self.port = 443
 
+        self.pool.clear()
         return None
 
 
@@ -326,6 +687,7 @@ class NaServer :
     """
 
         self.port = port
+        self.pool.clear()
 
 
 
@@ -379,136 +741,134 @@ class NaServer :
 
 
 
-    def invoke_elem(self, req):
+    def invoke_elem(self, req, vserver=None, parser=None):
         """Submit an XML request already encapsulated as
         an NaElement and return the result in another
         NaElement.
+
+        'vserver' optionally tunnels this one call to another
+        vserver (vfiler) than the one set with set_vserver().
+        'parser' optionally parses the response instead of a parser
+        of the parse backend, such as an NaStream.NaStreamParser.
+        NaServer may be shared between threads: each call uses its
+        own connection and parse state.
         """
-     
-        server = self.server
-        user = self.user
-        password = self.password
-        debug_style = self.debug_style
-        vfiler = self.vfiler
-        originator_id = self.originator_id
-        server_type = self.server_type
-        xmlrequest = req.toEncodedString()
-        url = self.url
-        vfiler_req = ""
-        originator_id_req = ""
-        nmsdk_app_req = ""
 
+        if (vserver == None):
+            vserver = self.vfiler
+        api = req.name
+        start = clock()
+        span = self.tracer.start_span(self.server, api, vserver or None)
         try:
+            (out, request_bytes, response_bytes) = self.invoke_request(req, vserver, span, parser)
+        except:
+            span.finish(error=sys.exc_info()[1])
+            if (self.metrics != None):
+                self.metrics.record(self.server, api, clock() - start, 13001)
+            raise
+        span.finish(out)
+        if (self.metrics != None):
+            error_code = 0
+            if (out.results_status() == "failed"):
+                error_code = int(out.results_errno())
+            self.metrics.record(self.server, api, clock() - start, error_code,
+                                request_bytes, response_bytes)
+        return out
+
+
+
+    def invoke_request(self, req, vserver, span, parser=None):
+        """This is a private function, not to be called from outside NaServer.
+        Does the work of invoke_elem(), reporting its phases to 'span'.
+        Returns the results with the sizes of the request and response.
+        """
 
-            if(self.transport_type == "HTTP"):
-                    if(python_version < 2.6):  # python versions prior to 2.6 do not support 'timeout'
-                        connection = httplib.HTTPConnection(server, port=self.port)
-                    else :
-                        connection = httplib.HTTPConnection(server, port=self.port, timeout=self.timeout)
-
-            else : # for HTTPS
-
-                    if (self.need_cba == True or self.need_server_auth == True):
-                        if (python_version < 2.6):
-                            cba_err = "certificate based authentication is not supported with Python " + str(python_version) + "." 
-                            return self.fail_response(13001, cba_err) 
-                        connection = CustomHTTPSConnection(server, self.port, key_file=self.key_file, 
-                        cert_file=self.cert_file, ca_file=self.ca_file, 
-                        need_server_auth=self.need_server_auth, 
-                        need_cn_verification=self.need_cn_verification, 
-                        timeout=self.timeout)
+        debug_style = self.debug_style
+        (content, authheader) = self.build_request(req, vserver)
+        (content, content_encoding) = self.compress_request(content)
+        request_bytes = len(content)
+        span.set_request_bytes(request_bytes)
+        span.phase("serialize")
+
+        # Pooled connections may have been dropped by the server while
+        # they were idle; such a failure is retried on the next pooled
+        # connection, or on a new one once the pool is drained. Other
+        # failures, timeouts above all, are not retried, as the server
+        # may have got the request.
+        while True:
+            connection = self.pool.get()
+            reused = (connection != None)
+
+            try:
+                if (not reused):
+                    (connection, failure) = self.open_connection()
+                    if (failure != None):
+                        return (failure, request_bytes, 0)
+                    if (connection.sock == None):
                         connection.connect()
-                        if (self.need_cn_verification == True):
-                            cn_name = connection.get_commonName()
-                            if (cn_name.lower() != server.lower()) :
-                                cert_err = "server certificate verification failed: server certificate name (CN=" + cn_name + "), hostname (" + server + ") mismatch."
-                                connection.close()
-                                return self.fail_response(13001, cert_err)
-                    else :
-                        if(python_version < 2.6): # python versions prior to 2.6 do not support 'timeout'
-                            connection = httplib.HTTPSConnection(server, port=self.port)
-                        else :
-                            connection = httplib.HTTPSConnection(server, port=self.port, timeout=self.timeout)
-
-            connection.putrequest("POST", self.url)
-            connection.putheader("Content-type", "text/xml; charset=\"UTF-8\"")
-
-            if(self.get_style() != "HOSTS"):
-
-                if(python_version < 3.0):
-                    base64string = base64.encodestring("%s:%s" %(user,password))[:-1]
-                    authheader = "Basic %s" %base64string
-                elif(python_version == 3.0):
-                    base64string = base64.encodestring(('%s:%s' %( user, password)).encode())
-                    authheader = "Basic %s" % base64string.decode().strip()
-                else:
-                    base64string = base64.encodebytes(('%s:%s' %( user, password)).encode())
-                    authheader = "Basic %s" % base64string.decode().strip()
-
-                connection.putheader("Authorization", authheader)
-
-            if(vfiler != ""):
-                vfiler_req = " vfiler=\"" + vfiler + "\""
-
-            if(originator_id != ""):
-                originator_id_req = " originator_id=\"" + originator_id + "\""
-
-            if(nmsdk_app_name != ""):
-                nmsdk_app_req = " nmsdk_app=\"" + nmsdk_app_name + "\"";
-
-            content = '<?xml version=\'1.0\' encoding=\'utf-8\'?>'\
-                     +'\n'+\
-                     '<!DOCTYPE netapp SYSTEM \'' + self.dtd + '\''\
-                     '>' \
-                     '<netapp' \
-                     + vfiler_req + originator_id_req + \
-                     ' version="'+str(self.major_version)+'.'+str(self.minor_version)+'"'+' xmlns="' + ZAPI_xmlns  + "\"" \
-                     + " nmsdk_version=\"" + NMSDK_VERSION + "\"" \
-                     + " nmsdk_platform=\"" + NMSDK_PLATFORM + "\"" \
-                     + " nmsdk_language=\"" + NMSDK_LANGUAGE + "\"" \
-                     + nmsdk_app_req \
-                     + ">" \
-                     + xmlrequest + '</netapp>'
-
-            if(debug_style == "NA_PRINT_DONT_PARSE"):
-                print(("INPUT \n" +content))
-
-            if(python_version < 3.0):
-                connection.putheader("Content-length", len(content))
-                connection.endheaders()
-                connection.send(content)
-            else :
-                connection.putheader("Content-length", str(len(content)))
-                connection.endheaders()
-                connection.send(content.encode())
+                span.phase("connect")
+
+                self.send_request(connection, content, authheader, content_encoding)
+                span.phase("send")
+                response = connection.getresponse()
+                span.phase("wait")
+                break
+
+            except (socket.error, httplib.HTTPException):
+                if (connection != None):
+                    connection.close()
+                message = sys.exc_info()
+                if (not reused or not is_stale_connection_error(message[1])):
+                    return (self.fail_response(13001, message[1]), request_bytes, 0)
+                self.pool.reconnected()
 
-
-        except socket.error :
-            message = sys.exc_info()
-            return (self.fail_response(13001, message[1]))
-
-        response = connection.getresponse()
-    
         if not response :
             connection.close()
-            return self.fail_response(13001,"No response received")
+            return (self.fail_response(13001,"No response received"), request_bytes, 0)
 
         if(response.status == 401):
             connection.close()
-            return self.fail_response(13002,"Authorization failed")
-
-        xml_response = response.read()
+            return (self.fail_response(13002,"Authorization failed"), request_bytes, 0)
+
+        if(content_encoding != None and response.status != 200):
+            response.read()
+            self.release_connection(connection, response)
+            if(response.status not in REJECTED_ENCODING_STATUSES):
+                return (self.fail_response(13001, "HTTP status " + str(response.status)),
+                        request_bytes, 0)
+            # The server did not take the compressed request: stop
+            # compressing requests to it and send this one again.
+            self.request_compression_supported = False
+            return self.invoke_request(req, vserver, span, parser)
 
         if(self.is_debugging() > 0):
 
             if(debug_style != "NA_PRINT_DONT_PARSE"):
+                xml_response = response.read()
+                self.release_connection(connection, response)
                 self.set_raw_xml_output(xml_response)
                 print(("\nOUTPUT :",xml_response,"\n"))
-                connection.close()
-                return self.fail_response(13001, "debugging bypassed xml parsing")
-        
-        connection.close()
-        return self.parse_xml(xml_response)
+                return (self.fail_response(13001, "debugging bypassed xml parsing"),
+                        request_bytes, len(xml_response))
+
+        # The body is parsed as it arrives rather than buffered first,
+        # so parsing overlaps the transfer and the raw response is
+        # never held in memory as a whole.
+        if (parser == None):
+            parser = self.new_parser()
+        p = span.track_parser(get_response_parser(response.getheader("Content-Encoding"),
+                                                  parser))
+        try:
+            response_bytes = self.read_response(response, p)
+        except:
+            connection.close()
+            raise
+        self.release_connection(connection, response)
+        span.phase("read")
+
+        out = self.get_results(p.get_root())
+        span.phase("parse")
+        return (out, request_bytes, response_bytes)
 
 
 
@@ -543,6 +903,54 @@ class NaServer :
 
 
 
+    def invoke_many(self, requests, max_workers=None):
+        """Submits a batch of independent requests, up to 'max_workers'
+    at a time (by default, the connection pool size), and returns
+    their results in the order of 'requests'.
+
+    Each request is an NaElement or an (api, args) tuple, where args
+    is a dictionary or a sequence of name, value pairs as given to
+    invoke(). A request that fails yields a failed results element
+    in its place; the rest of the batch still runs.
+
+    Example: myserver->invoke_many([('volume-list-info', ('volume', 'vol0')),
+                                    ('volume-list-info', {'volume': 'vol1'})])
+    """
+
+        requests = list(requests)
+        results = [None] * len(requests)
+        if (max_workers == None):
+            max_workers = max(self.pool.size, 1)
+        pending = iter(enumerate(requests))
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                lock.acquire()
+                try:
+                    item = next(pending, None)
+                finally:
+                    lock.release()
+                if (item == None):
+                    return
+                (index, req) = item
+                try:
+                    results[index] = self.invoke_elem(self.make_request(req))
+                except Exception :
+                    message = sys.exc_info()
+                    results[index] = self.fail_response(13001, str(message[1]))
+
+        workers = [threading.Thread(target=worker)
+                   for i in range(min(max_workers, len(requests)))]
+        for thread in workers:
+            thread.daemon = True
+            thread.start()
+        for thread in workers:
+            thread.join()
+        return results
+
+
+
     def set_vfiler(self, vfiler_name):
         """Sets the vfiler name. This function is used
     for vfiler-tunneling.
@@ -550,6 +958,7 @@ class NaServer :
 
         if(self.major_version >= 1 and self.minor_version >= 7 ):
                 self.vfiler = vfiler_name
+                self.request_prefixes = {}
                 return 1
 
         return 0
@@ -564,6 +973,7 @@ class NaServer :
             print("\nPython versions prior to 2.6 do not support timeout.\n")
             return
         self.timeout = timeout
+        self.pool.clear()
 
 
 
@@ -574,6 +984,189 @@ class NaServer :
 
         return self.timeout
 
+
+
+    def set_compression(self, enable, request_min_size=None):
+        """Enables or disables compressed transfers. When enabled,
+    the server is asked for gzip or deflate compressed responses,
+    which are decompressed while they are parsed; a server without
+    compression support simply answers uncompressed. If
+    'request_min_size' is given, requests of at least that many bytes
+    are sent gzip compressed too. Should the server reject a
+    compressed request, it is sent again uncompressed and requests are
+    no longer compressed on this connection.
+    """
+
+        if (enable != True and enable != False):
+            return self.fail_response(13001, "NaServer::set_compression: invalid argument " + str(enable) + " specified")
+        self.compression = enable
+        self.request_compression_supported = True
+        if (enable == True):
+            self.request_compression_min_size = request_min_size
+        else :
+            self.request_compression_min_size = None
+        return None
+
+
+
+    def is_compression_enabled(self):
+        """ Determines whether compressed transfers are enabled or not.
+        Returns True if it is enabled, else returns False
+        """
+
+        return self.compression
+
+
+
+    def set_connection_pool(self, size, idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT):
+        """Sets the number of idle keep-alive connections kept open
+    to the server, and the number of seconds an idle connection
+    may be reused. A size of 0 disables connection reuse.
+    """
+
+        self.pool.clear()
+        self.pool.size = size
+        self.pool.idle_timeout = idle_timeout
+
+
+
+    def get_connection_pool_stats(self):
+        """Returns a dictionary with the connection pool statistics:
+    'hits' and 'misses' count calls that did or did not find an
+    idle connection, 'expired' counts idle connections closed after
+    the idle timeout and 'reconnects' counts pooled connections that
+    had been dropped by the server.
+    """
+
+        return self.pool.get_stats()
+
+
+
+    def close(self):
+        """Closes all idle connections to the server.
+    """
+
+        self.pool.clear()
+
+
+
+    def warm_up(self, count=1):
+        """Opens 'count' connections to the server ahead of the first
+    call and keeps them in the connection pool, so that the first
+    calls do not wait for TCP and TLS handshakes. Returns a failure
+    response if a connection cannot be opened, None otherwise.
+    """
+
+        for i in range(count):
+            try:
+                (connection, failure) = self.open_connection()
+                if (failure != None):
+                    return failure
+                if (connection.sock == None):
+                    connection.connect()
+            except socket.error :
+                message = sys.exc_info()
+                return (self.fail_response(13001, message[1]))
+            self.pool.put(connection)
+        return None
+
+    def set_parse_backend(self, backend):
+        """Selects how responses are parsed:
+    'expat'      builds the NaElements from expat callbacks (default)
+    'etree'      builds the document with the C accelerated
+                 xml.etree.ElementTree and converts it to NaElements
+    'etree-view' builds the document with ElementTree and returns
+                 NaElements that read the ElementTree nodes as they
+                 are used (see NaEtree.NaEtreeElement)
+    'lazy'       keeps the raw response and returns NaElements that
+                 decode their part of it as they are used, so that
+                 subtrees that are never read are never parsed (see
+                 NaLazy.NaLazyElement)
+    The results behave the same with every backend.
+    """
+
+        if (backend not in PARSE_BACKENDS):
+            return self.fail_response(13001, "NaServer::set_parse_backend: invalid backend " + str(backend) + " specified")
+        self.parse_backend = backend
+        return None
+
+
+
+    def get_parse_backend(self):
+        """Returns the backend set with set_parse_backend().
+        """
+
+        return self.parse_backend
+
+
+
+    def set_intern_table(self, table):
+        """Sets the NaElement.NaInternTable through which the content of
+    the elements of responses goes, so that values repeated across
+    elements and responses are stored once. None, the default,
+    interns no content. Tag names are always interned. The 'etree-view'
+    and 'lazy' backends do not use the table.
+
+    Example: myserver.set_intern_table(NaInternTable())
+    """
+
+        self.intern_table = table
+
+
+
+    def get_intern_table(self):
+        """Returns the table set with set_intern_table().
+        """
+
+        return self.intern_table
+
+
+
+    def set_tracer(self, tracer=None):
+        """Sets the tracer that is given a span for each call, see
+    NaTrace.NaTracer. With no tracer, calls are not traced.
+
+    Example: myserver.set_tracer(NaTracer(NaJSONLinesExporter('zapi.jsonl')))
+    """
+
+        if (tracer == None):
+            tracer = NULL_TRACER
+        self.tracer = tracer
+
+
+
+    def get_tracer(self):
+        """Returns the tracer set with set_tracer().
+        """
+
+        return self.tracer
+
+
+
+    def set_metrics_registry(self, registry):
+        """Sets the NaMetrics.NaMetricsRegistry that calls are recorded
+    in, by default the registry shared by all NaServers
+    (NaMetrics.DEFAULT_REGISTRY). None stops recording.
+    """
+
+        self.metrics = registry
+
+
+
+    def get_metrics(self, api=None):
+        """Returns the metrics of the calls to the server as a list with
+    a dictionary per API, see NaMetricsRegistry.snapshot(), or the
+    dictionary of 'api' only (None if it has not been called).
+    """
+
+        if (self.metrics == None):
+            return None
+        if (api != None):
+            return self.metrics.get(self.server, api)
+        return self.metrics.snapshot(self.server)
+
+
+
     def set_client_cert_and_key(self, cert_file, key_file):
         """ Sets the client certificate and key files that are required for client authentication
         by the server using certificates. If key file is not defined, then the certificate file 
@@ -585,6 +1178,7 @@ class NaServer :
             self.key_file = key_file
         else:
             self.key_file = cert_file
+        self.reset_ssl_context()
 
     def set_ca_certs(self, ca_file):
         """ Specifies the certificates of the Certificate Authorities (CAs) that are 
@@ -592,6 +1186,7 @@ class NaServer :
         """
 
         self.ca_file = ca_file
+        self.reset_ssl_context()
 
     def set_server_cert_verification(self, enable):
         """ Enables or disables server certificate verification by the client.
@@ -609,6 +1204,7 @@ class NaServer :
             return self.fail_response(13001,"in NaServer::set_server_cert_verification: server certificate verification cannot be used as 'ssl' module is not imported.")
         self.need_server_auth = enable
         self.need_cn_verification = enable
+        self.reset_ssl_context()
         return None
 
     def is_server_cert_verification_enabled(self):
@@ -628,6 +1224,7 @@ class NaServer :
         if (self.need_server_auth == False):
             return self.fail_response(13001, "in NaServer::set_hostname_verification: server certificate verification is not enabled")
         self.need_cn_verification = enable
+        self.pool.clear()
         return None;
 
     def is_hostname_verification_enabled(self):
@@ -653,68 +1250,320 @@ class NaServer :
 
 
 
-    def start_element(self, name, attrs):
-        """This is a private function, not to be called from outside NaElement
+    def make_request(self, req):
+        """This is a private function, not to be called from outside NaServer.
+        Returns 'req' as an NaElement, see invoke_many().
         """
 
-        n = NaElement(name)
-        self.ZAPI_stack.append(n)
-        self.ZAPI_atts = {}
-        attr_name = list(attrs.keys())
-        attr_value = list(attrs.values())
-        i = 0
-        for att in attr_name :
-            val = attr_value[i]
-            i = i+1
-            self.ZAPI_atts[att] = val
-            n.attr_set(att,val)
+        if (isinstance(req, NaElement)):
+            return req
+        (api, args) = req
+        if (isinstance(args, dict)):
+            args = args.items()
+        else :
+            if ((len(args) & 1) != 0):
+                raise ValueError("in Zapi::invoke_many, invalid number of parameters for " + api)
+            args = zip(args[0::2], args[1::2])
+        xi = NaElement(api)
+        for (key, value) in args:
+            xi.child_add(NaElement(key, value))
+        return xi
 
 
 
-    def end_element(self, name):
-        """This is a private function, not to be called from outside NaElement
+    def new_parser(self):
+        """This is a private function, not to be called from outside NaServer.
+        Returns a response parser for the selected backend.
         """
 
-        stack_len = len(self.ZAPI_stack)
+        if (self.parse_backend == "expat"):
+            return NaResponseParser(self.intern_table)
+        if (self.parse_backend == "lazy"):
+            from .NaLazy import NaLazyParser
+            return NaLazyParser()
+        from .NaEtree import NaEtreeParser
+        return NaEtreeParser(self.parse_backend == "etree-view", self.intern_table)
 
-        if (stack_len > 1):
-            n = self.ZAPI_stack.pop(stack_len - 1)
-            i = len(self.ZAPI_stack)
 
-            if(i != stack_len - 1):
-                print("pop did not work!!!!\n")
 
-            self.ZAPI_stack[i-1].child_add(n)
+    def open_connection(self):
+        """This is a private function, not to be called from outside NaServer.
+        Returns a tuple of the new connection and a failure response,
+        one of which is None.
+        """
 
+        server = self.server
 
+        if(self.transport_type == "HTTP"):
+                if(python_version < 2.6):  # python versions prior to 2.6 do not support 'timeout'
+                    connection = httplib.HTTPConnection(server, port=self.port)
+                else :
+                    connection = httplib.HTTPConnection(server, port=self.port, timeout=self.timeout)
+
+        else : # for HTTPS
+
+                if (self.need_cba == True or self.need_server_auth == True):
+                    if (python_version < 2.6):
+                        cba_err = "certificate based authentication is not supported with Python " + str(python_version) + "." 
+                        return (None, self.fail_response(13001, cba_err))
+
+                if (ssl_context_attr == True):
+                    connection = CustomHTTPSConnection(server, self.port, key_file=self.key_file, 
+                    cert_file=self.cert_file, ca_file=self.ca_file, 
+                    need_server_auth=self.need_server_auth, 
+                    need_cn_verification=self.need_cn_verification, 
+                    timeout=self.timeout, context=self.get_ssl_context(),
+                    session=self.ssl_session)
+                    connection.connect()
+                    if (connection.session_reused()):
+                        self.pool.resumed_session()
+                elif (self.need_cba == True or self.need_server_auth == True):
+                    connection = CustomHTTPSConnection(server, self.port, key_file=self.key_file, 
+                    cert_file=self.cert_file, ca_file=self.ca_file, 
+                    need_server_auth=self.need_server_auth, 
+                    need_cn_verification=self.need_cn_verification, 
+                    timeout=self.timeout)
+                    connection.connect()
+                else :
+                    if(python_version < 2.6): # python versions prior to 2.6 do not support 'timeout'
+                        connection = httplib.HTTPSConnection(server, port=self.port)
+                    else :
+                        connection = httplib.HTTPSConnection(server, port=self.port, timeout=self.timeout)
 
-    def char_data(self, data):
-        """This is a private function, not to be called from outside NaElement
+                if (self.need_cn_verification == True):
+                    cn_name = connection.get_commonName()
+                    if (cn_name.lower() != server.lower()) :
+                        cert_err = "server certificate verification failed: server certificate name (CN=" + cn_name + "), hostname (" + server + ") mismatch."
+                        connection.close()
+                        return (None, self.fail_response(13001, cert_err))
+
+        return (connection, None)
+
+
+
+    def build_request(self, req, vserver=None):
+        """This is a private function, not to be called from outside NaServer.
+        Returns the encoded request document for 'req' and the
+        Authorization header value, or None if no header is needed.
         """
 
-        i = len(self.ZAPI_stack)
-        data = NaElement.escapeHTML(data)
-        self.ZAPI_stack[i-1].add_content(data)
+        vfiler = self.vfiler
+        if (vserver != None):
+            vfiler = vserver
+        xmlrequest = req.toEncodedString()
+
+        if(self.debug_style == "NA_PRINT_DONT_PARSE"):
+            print(("INPUT \n" + self.get_request_prefix(vfiler, False) + xmlrequest + '</netapp>'))
+
+        if(python_version < 3.0):
+            content = self.get_request_prefix(vfiler) + xmlrequest + '</netapp>'
+        else :
+            content = self.get_request_prefix(vfiler) + xmlrequest.encode() + b'</netapp>'
+
+        return (content, self.authheader)
+
+
+
+    def get_request_prefix(self, vfiler, encoded=True):
+        """This is a private function, not to be called from outside NaServer.
+        Returns the request document up to and including the <netapp>
+        start tag. Prefixes are cached per vfiler and application name;
+        the setters of the other parts of the prefix clear the cache.
+        """
+
+        key = (vfiler, nmsdk_app_name, encoded)
+        prefix = self.request_prefixes.get(key)
+        if(prefix != None):
+            return prefix
+
+        vfiler_req = ""
+        originator_id_req = ""
+        nmsdk_app_req = ""
+
+        if(vfiler != ""):
+            vfiler_req = " vfiler=\"" + vfiler + "\""
+
+        if(self.originator_id != ""):
+            originator_id_req = " originator_id=\"" + self.originator_id + "\""
+
+        if(nmsdk_app_name != ""):
+            nmsdk_app_req = " nmsdk_app=\"" + nmsdk_app_name + "\"";
+
+        prefix = '<?xml version=\'1.0\' encoding=\'utf-8\'?>'\
+                 +'\n'+\
+                 '<!DOCTYPE netapp SYSTEM \'' + self.dtd + '\''\
+                 '>' \
+                 '<netapp' \
+                 + vfiler_req + originator_id_req + \
+                 ' version="'+str(self.major_version)+'.'+str(self.minor_version)+'"'+' xmlns="' + ZAPI_xmlns  + "\"" \
+                 + " nmsdk_version=\"" + NMSDK_VERSION + "\"" \
+                 + " nmsdk_platform=\"" + get_nmsdk_platform() + "\"" \
+                 + " nmsdk_language=\"" + NMSDK_LANGUAGE + "\"" \
+                 + nmsdk_app_req \
+                 + ">"
+
+        if(encoded and python_version >= 3.0):
+            prefix = prefix.encode()
+
+        self.request_prefixes[key] = prefix
+        return prefix
+
+
+
+    def update_authheader(self):
+        """This is a private function, not to be called from outside NaServer.
+        Encodes the Authorization header once per change of the
+        credentials or the style, rather than on every call.
+        """
+
+        if(self.style == "HOSTS"):
+            self.authheader = None
+        elif(python_version < 3.0):
+            self.authheader = "Basic %s" % base64.b64encode("%s:%s" % (self.user, self.password))
+        else :
+            self.authheader = "Basic %s" % base64.b64encode(('%s:%s' % (self.user, self.password)).encode()).decode()
+
+
+
+    def compress_request(self, content):
+        """This is a private function, not to be called from outside NaServer.
+        Returns the request body to send and its Content-Encoding,
+        which is None unless the body was compressed.
+        """
+
+        min_size = self.request_compression_min_size
+        if(min_size == None or len(content) < min_size or not self.request_compression_supported):
+            return (content, None)
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return (compressor.compress(content) + compressor.flush(), "gzip")
+
+
+
+    def send_request(self, connection, content, authheader, content_encoding=None):
+        """This is a private function, not to be called from outside NaServer
+        """
+
+        connection.putrequest("POST", self.url, skip_accept_encoding=self.compression)
+        connection.putheader("Content-type", "text/xml; charset=\"UTF-8\"")
+
+        if(authheader != None):
+            connection.putheader("Authorization", authheader)
+
+        if(self.compression):
+            connection.putheader("Accept-Encoding", ACCEPT_ENCODING)
+
+        if(content_encoding != None):
+            connection.putheader("Content-Encoding", content_encoding)
+
+        connection.putheader("Content-length", str(len(content)))
+        connection.endheaders()
+        connection.send(content)
+
+
+
+    def read_response(self, response, parser):
+        """This is a private function, not to be called from outside NaServer.
+        Feeds the response body to 'parser' in READ_CHUNK_SIZE pieces
+        and returns its size.
+        """
+
+        size = 0
+        while True:
+            data = response.read(READ_CHUNK_SIZE)
+            if not data:
+                break
+            size += len(data)
+            parser.feed(data)
+        parser.feed(data, 1)
+        return size
+
+
+
+    def get_ssl_context(self):
+        """This is a private function, not to be called from outside NaServer.
+        Returns the SSLContext shared by all HTTPS connections to the
+        server, creating it from the certificate settings on first use,
+        so that certificates and CA files are only loaded once.
+        """
+
+        context = self.ssl_context
+        if (context != None):
+            return context
+
+        if (self.need_cba == True or self.need_server_auth == True):
+            context = ssl.SSLContext(getattr(ssl, "PROTOCOL_TLS_CLIENT", ssl.PROTOCOL_SSLv23))
+            # the common name is verified by open_connection()
+            context.check_hostname = False
+            if (self.need_server_auth == True):
+                context.verify_mode = ssl.CERT_REQUIRED
+                if (self.ca_file != None):
+                    context.load_verify_locations(self.ca_file)
+                else :
+                    context.load_default_certs()
+            else :
+                context.verify_mode = ssl.CERT_NONE
+            if (self.cert_file != None):
+                context.load_cert_chain(self.cert_file, self.key_file)
+        else :
+            # the context httplib would use for a plain HTTPSConnection,
+            # honouring the PEP 476 opt-out
+            context = ssl._create_default_https_context()
+
+        self.ssl_context = context
+        return context
+
+
+
+    def reset_ssl_context(self):
+        """This is a private function, not to be called from outside NaServer.
+        Drops the SSLContext, the TLS session and the pooled connections
+        after a change of the certificate settings.
+        """
+
+        self.ssl_context = None
+        self.ssl_session = None
+        self.pool.clear()
+
+
+
+    def release_connection(self, connection, response):
+        """This is a private function, not to be called from outside NaServer.
+        Keeps the connection for the next call unless the server asked
+        for it to be closed, and remembers its TLS session so that new
+        connections can resume it.
+        """
+
+        if (ssl_session_attr == True and connection.sock != None):
+            session = getattr(connection.sock, "session", None)
+            if (session != None):
+                self.ssl_session = session
+
+        if(response.will_close):
+            connection.close()
+        else :
+            self.pool.put(connection)
 
 
 
     def parse_xml(self, xmlresponse):
         """This is a private function, not to be called from outside NaElement
         """
-        p = xml.parsers.expat.ParserCreate()
-        p.StartElementHandler = self.start_element
-        p.EndElementHandler = self.end_element
-        p.CharacterDataHandler = self.char_data
-        p.Parse(xmlresponse, 1)
-        stack_len = len(self.ZAPI_stack)
+        p = self.new_parser()
+        p.feed(xmlresponse, 1)
+        return self.get_results(p.get_root())
 
-        if(stack_len <= 0):
-            return self.fail_response(13001,"Zapi::parse_xml-no elements on stack")
 
-        r = self.ZAPI_stack.pop(stack_len - 1)
 
-        if (r.element['name'] != "netapp") :
-            return self.fail_response(13001, "Zapi::parse_xml - Expected <netapp> element but got " + r.element['name'])
+    def get_results(self, r):
+        """This is a private function, not to be called from outside NaElement
+        """
+
+        if(r == None):
+            return self.fail_response(13001,"Zapi::parse_xml-no elements on stack")
+
+        if (r.name != "netapp") :
+            return self.fail_response(13001, "Zapi::parse_xml - Expected <netapp> element but got " + r.name)
 
         results = r.child_get("results")
 
@@ -729,18 +1578,13 @@ class NaServer :
         """This is a private function, not to be called from outside NaElement
         """
 
-        p = xml.parsers.expat.ParserCreate()
-        p.StartElementHandler = self.start_element
-        p.EndElementHandler = self.end_element
-        p.CharacterDataHandler = self.char_data
-        p.Parse(xmlrequest,1)
-        stack_len = len(self.ZAPI_stack)
+        p = self.new_parser()
+        p.feed(xmlrequest, 1)
+        r = p.get_root()
 
-        if(stack_len <= 0):
+        if(r == None):
             return self.fail_response(13001,"Zapi::parse_xml-no elements on stack")
 
-        r = self.ZAPI_stack.pop(stack_len - 1)
-
         return r
 
 
@@ -749,6 +1593,8 @@ class NaServer :
         """ Sets the name of the client application.
         """
 
+        # cached request prefixes are keyed by application name, so
+        # the new name takes effect on every NaServer's next call
         global nmsdk_app_name
         nmsdk_app_name = app_name
 
@@ -764,6 +1610,8 @@ class NaServer :
     @staticmethod
     def get_platform_info():
         """ Returns the platform information.
+        Only in-process sources are used, so that no subprocesses are
+        started.
         """
 
         systemType = "Unknown"
@@ -772,8 +1620,12 @@ class NaServer :
         osInfo = ""
 
         try:
-            import platform
-            systemType = platform.system()
+            import os
+            if (hasattr(os, "uname")):
+                (systemType, node, release, version, machine) = os.uname()[:5]
+            else:
+                import platform
+                systemType = platform.system()
             if (systemType == "Windows" or systemType == "Microsoft"):
                 systemType = "Windows"
                 if(python_version < 3.0):
@@ -794,77 +1646,85 @@ class NaServer :
                     winreg.CloseKey(handle)
                 osInfo = osName + " " + processor
             else:
-                import os
                 if (systemType == "Linux"):
                     import re
-                    pipe = ""
                     if os.path.isfile("/etc/SuSE-release"):
-                        pipe = os.popen('head -n 1 /etc/SuSE-release')
+                        release_file = open("/etc/SuSE-release")
                     else:
-                        pipe = os.popen("head -n 1 /etc/issue")
-                    osName = pipe.readline()
-                    pipe.close()
+                        release_file = open("/etc/issue")
+                    osName = release_file.readline()
+                    release_file.close()
                     osName = osName.rstrip()
                     m = re.search("(.*?) \(.*?\)", osName)
                     if m:
                         osName = m.groups()[0]
-                    pipe = os.popen('uname -p')
-                    processor = pipe.readline()
-                    pipe.close()
-                    processor = processor.rstrip()
+                    processor = machine
                     osInfo = osName + " " + processor
                 elif (systemType == 'SunOS'):
-                    pipe = os.popen('uname -srp')
-                    unameInfo = pipe.readline()
-                    pipe.close()
-                    unameInfo = unameInfo.rstrip()
-                    pipe = os.popen('isainfo -b')
-                    isaInfo = pipe.readline()
-                    pipe.close()
-                    isaInfo = isaInfo.rstrip()
-                    isaInfo += "-bit"
+                    import struct
+                    unameInfo = systemType + " " + release + " " + machine
+                    isaInfo = str(struct.calcsize("P") * 8) + "-bit"
                     osInfo = unameInfo + " " + isaInfo
-                elif (systemType == 'HP-UX'):
-                    pipe = os.popen('uname -srm')
-                    osInfo = pipe.readline()
-                    pipe.close()
-                    osInfo = osInfo.rstrip()
-                elif (systemType == 'FreeBSD'):
-                    pipe = os.popen('uname -srm')
-                    osInfo = pipe.readline()
-                    pipe.close()
-                    osInfo = osInfo.rstrip()
+                elif (systemType == 'HP-UX' or systemType == 'FreeBSD'):
+                    osInfo = systemType + " " + release + " " + machine
                 else:
                     osInfo = systemType
         except:
             osInfo = systemType
         return osInfo
 
-NMSDK_PLATFORM = NaServer.get_platform_info()
+
+
+#platform information sent with every request; it is only looked up
+#when the first request is built, see get_nmsdk_platform()
+NMSDK_PLATFORM = None
+
+def get_nmsdk_platform():
+    """ Returns the platform information sent to the server, looking
+    it up on first use.
+    """
+
+    global NMSDK_PLATFORM
+    if (NMSDK_PLATFORM == None):
+        NMSDK_PLATFORM = NaServer.get_platform_info()
+    return NMSDK_PLATFORM
+
 
 try:
     class CustomHTTPSConnection(httplib.HTTPSConnection):
-        """ Custom class to make a HTTPS connection, with support for Certificate Based Authentication"""
+        """ Custom class to make a HTTPS connection, with support for Certificate Based Authentication.
+        Given an SSLContext, the connection uses it instead of loading the certificates
+        itself, and tries to resume the given TLS session."""
 
         def __init__(self, host, port, key_file, cert_file, ca_file, 
-                   need_server_auth, need_cn_verification, timeout=None):
-            httplib.HTTPSConnection.__init__(self, host, port=port, key_file=key_file, 
-                                     cert_file=cert_file,timeout=timeout)
+                   need_server_auth, need_cn_verification, timeout=None,
+                   context=None, session=None):
+            httplib.HTTPSConnection.__init__(self, host, port=port, timeout=timeout)
             self.key_file = key_file
             self.cert_file = cert_file
             self.ca_file = ca_file
             self.timeout = timeout
             self.need_server_auth = need_server_auth
             self.need_cn_verification = need_cn_verification
+            self.context = context
+            self.session = session
 
         def connect(self):
             sock = socket.create_connection((self.host, self.port), self.timeout)
 
-            if (self.need_server_auth == True):
+            if (self.context != None):
+                if (self.session != None):
+                    self.sock = self.context.wrap_socket(sock, server_hostname=self.host, session=self.session)
+                else:
+                    self.sock = self.context.wrap_socket(sock, server_hostname=self.host)
+            elif (self.need_server_auth == True):
                 self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file, ca_certs=self.ca_file, cert_reqs=ssl.CERT_REQUIRED)
             else:
                 self.sock = ssl.wrap_socket(sock, self.key_file, self.cert_file, ca_certs=self.ca_file)
 
+        def session_reused(self):
+            return getattr(self.sock, 'session_reused', False) == True
+
         def get_commonName(self):
             cert = self.sock.getpeercert()
             for x in cert['subject'] :
@@ -873,7 +1733,3 @@ try:
             return ""
 except AttributeError:
     pass
-
-
-
-
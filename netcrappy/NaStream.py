@@ -0,0 +1,175 @@
+#============================================================#
+#                                                            #
+# NaStream.py                                                #
+#                                                            #
+# Schema-directed extraction of records while parsing.       #
+#                                                            #
+#============================================================#
+
+"""
+Extraction of the records of a response while it is parsed, for
+read-only calls that only want a few fields of each record, see
+NaStreamParser and Cluster.api_stream_iter().
+
+NaStreamParser builds the NaElements of a response as NaResponseParser
+does, except for the records in its list element ('attributes-list',
+the records of an iter API, by default). Those are extracted with an
+api_recurse() schema straight from the expat callbacks, giving the
+dictionary compile_schema(schema) would give for the record's
+NaElement, and each is passed to a callback as soon as its end tag has
+been parsed. The elements the schema does not name are skipped without
+their text ever reaching Python. The memory a page takes therefore
+does not grow with its number of records. The list element stays in
+the results, without children.
+"""
+
+from .NaElement import NaElement
+from .NaServer import NaResponseParser
+
+#kinds of the fields of a plan
+TEXT = 0
+RECORD = 1
+LIST = 2
+
+#value types and their value when the element is missing
+TEXT_TYPES = {"string": None, "integer": None, "boolean": False}
+
+
+def stream_plan(schema):
+    """This is a private function, not to be called from outside NaStream.
+    Returns the fields of 'schema' by element name, as (kind, value
+    type or nested plan), and the record of the schema without any of
+    its elements.
+    """
+
+    fields = {}
+    defaults = {}
+    for (key, value) in schema.items():
+        if (isinstance(value, dict)):
+            if (value.get("is_list", False)):
+                fields[key] = (LIST, stream_plan(value))
+            else :
+                fields[key] = (RECORD, stream_plan(value))
+            defaults[key] = None
+        elif (value in TEXT_TYPES):
+            fields[key] = (TEXT, value)
+            defaults[key] = TEXT_TYPES[value]
+    return (fields, defaults)
+
+
+class NaStreamParser(NaResponseParser) :
+    """A response parser that passes each record in the element
+    'list_name' to 'callback' as the dictionary the api_recurse()
+    schema 'schema' gives for it, see NaStream. 'count' is the number
+    of records passed so far. With 'intern_table' (see
+    NaServer.set_intern_table()) the string values are interned too.
+    """
+
+    def __init__(self, schema, callback, list_name="attributes-list", intern_table=None):
+        NaResponseParser.__init__(self, intern_table)
+        self.plan = stream_plan(schema)
+        self.callback = callback
+        self.list_name = list_name
+        self.count = 0
+        # the open elements of the list, as [kind, value type or plan,
+        # value, name], the list element first
+        self.frames = []
+        # the depth in the element being skipped
+        self.skipped = 0
+
+    def set_handlers(self, start, end, text):
+        """This is a private function, not to be called from outside NaStreamParser.
+        """
+
+        parser = self.parser
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = text
+
+    def start_element(self, name, attrs):
+        """This is a private function, not to be called from outside NaStreamParser
+        """
+
+        NaResponseParser.start_element(self, name, attrs)
+        if (name == self.list_name):
+            self.frames.append([LIST, self.plan, None, name])
+            self.set_handlers(self.record_start, self.record_end, None)
+
+    def record_start(self, name, attrs):
+        """This is a private function, not to be called from outside NaStreamParser
+        """
+
+        frame = self.frames[-1]
+        if (frame[0] == LIST):
+            plan = frame[1]
+            self.frames.append([RECORD, plan, dict(plan[1]), name])
+            return
+        if (frame[0] == RECORD):
+            field = frame[1][0].get(name)
+            if (field != None):
+                (kind, plan) = field
+                if (kind == TEXT):
+                    self.frames.append([TEXT, plan, [], name])
+                    self.parser.CharacterDataHandler = self.record_text
+                elif (kind == RECORD):
+                    self.frames.append([RECORD, plan, dict(plan[1]), name])
+                else :
+                    self.frames.append([LIST, plan, [], name])
+                return
+        # an element the schema does not name, or one in a value
+        self.skipped = 1
+        self.set_handlers(self.skip_start, self.skip_end, None)
+
+    def record_end(self, name):
+        """This is a private function, not to be called from outside NaStreamParser
+        """
+
+        frames = self.frames
+        (kind, plan, value, name) = frames.pop()
+        if (kind == TEXT):
+            self.parser.CharacterDataHandler = None
+            value = "".join(value)
+            if (plan == "integer"):
+                value = int(value)
+            elif (plan == "boolean"):
+                value = (value == "true")
+            else :
+                value = NaElement.escapeHTML(value)
+                if (self.intern_table != None):
+                    value = self.intern_table.intern(name, value)
+        elif (not frames):
+            # the end of the list element
+            self.set_handlers(self.start_element, self.end_element, self.char_data)
+            self.end_element(name)
+            return
+        parent = frames[-1]
+        if (parent[0] == RECORD):
+            parent[2][name] = value
+        elif (parent[2] != None):
+            parent[2].append(value)
+        else :
+            self.count = self.count + 1
+            self.callback(value)
+
+    def record_text(self, data):
+        """This is a private function, not to be called from outside NaStreamParser
+        """
+
+        self.frames[-1][2].append(data)
+
+    def skip_start(self, name, attrs):
+        """This is a private function, not to be called from outside NaStreamParser
+        """
+
+        self.skipped = self.skipped + 1
+
+    def skip_end(self, name):
+        """This is a private function, not to be called from outside NaStreamParser
+        """
+
+        self.skipped = self.skipped - 1
+        if (self.skipped == 0):
+            if (self.frames[-1][0] == TEXT):
+                self.set_handlers(self.record_start, self.record_end, self.record_text)
+            else :
+                self.set_handlers(self.record_start, self.record_end, None)
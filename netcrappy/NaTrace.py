@@ -0,0 +1,222 @@
+#============================================================#
+#                                                            #
+# NaTrace.py                                                 #
+#                                                            #
+# Per-call tracing of ONTAPI and DataFabric Manager requests.#
+#                                                            #
+#============================================================#
+
+"""
+Tracing hooks for NaServer.
+
+A tracer is given to NaServer.set_tracer(). For every call, NaServer
+asks it for a span with start_span() and reports the phases of the
+call to the span:
+
+  serialize   building (and compressing) the request document
+  connect     taking a pooled connection or opening a new one
+  send        writing the request
+  wait        waiting for the response status and headers
+  read        reading the response body
+  parse       building the NaElement tree from the body
+
+The span then goes to the tracer's exporter. The default tracer,
+NULL_TRACER, hands out a span that ignores all of this.
+"""
+
+import json
+import threading
+import time
+
+#a monotonic clock where there is one (Python 3.3 and later)
+clock = getattr(time, "perf_counter", time.time)
+
+
+class NaSpan :
+    """Timings and sizes of one call, see NaTracer.
+    """
+
+    def __init__(self, tracer, server, api, vserver):
+        self.tracer = tracer
+        self.server = server
+        self.api = api
+        self.vserver = vserver
+        self.start = time.time()
+        self.phases = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status = None
+        self.errno = 0
+        self.reason = None
+        self.duration = None
+        self.last = self.begin = clock()
+        self.nested = 0.0
+
+    def phase(self, name):
+        """Charges the time since the previous phase to phase 'name'.
+        """
+
+        now = clock()
+        elapsed = now - self.last - self.nested
+        self.last = now
+        self.nested = 0.0
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def set_request_bytes(self, size):
+        """Records the size of the request as sent.
+        """
+
+        self.request_bytes = size
+
+    def track_parser(self, parser):
+        """Returns 'parser' wrapped so that the time spent in it is
+    charged to the 'parse' phase, and the bytes fed to it are
+    counted as the response size.
+    """
+
+        return NaTracedParser(self, parser)
+
+    def finish(self, out=None, error=None):
+        """Ends the span with the results element 'out', or the
+    exception 'error', and exports it.
+    """
+
+        self.duration = clock() - self.begin
+        if (error != None):
+            self.status = "failed"
+            self.errno = 13001
+            self.reason = str(error)
+        elif (out != None):
+            self.status = out.results_status()
+            if (self.status == "failed"):
+                self.errno = int(out.results_errno())
+                self.reason = out.results_reason()
+        self.tracer.export(self)
+
+    def to_dict(self):
+        """Returns the span as a dictionary of plain values.
+        """
+
+        return {"server": self.server, "api": self.api,
+                "vserver": self.vserver, "start": self.start,
+                "duration": self.duration, "phases": self.phases,
+                "request_bytes": self.request_bytes,
+                "response_bytes": self.response_bytes,
+                "status": self.status, "errno": self.errno,
+                "reason": self.reason}
+
+
+class NaTracedParser :
+    """Response parser wrapper used by NaSpan.track_parser().
+    """
+
+    def __init__(self, span, parser):
+        self.span = span
+        self.parser = parser
+
+    def feed(self, data, final=0):
+        span = self.span
+        start = clock()
+        self.parser.feed(data, final)
+        elapsed = clock() - start
+        span.response_bytes += len(data)
+        span.nested += elapsed
+        span.phases["parse"] = span.phases.get("parse", 0.0) + elapsed
+
+    def get_root(self):
+        return self.parser.get_root()
+
+
+class NaNullSpan :
+    """The span of the NULL_TRACER: it records nothing.
+    """
+
+    def phase(self, name):
+        pass
+
+    def set_request_bytes(self, size):
+        pass
+
+    def track_parser(self, parser):
+        return parser
+
+    def finish(self, out=None, error=None):
+        pass
+
+
+class NaTracer :
+    """Creates a span per call and passes the finished spans to
+    'exporter', an object with an export(span) method (see
+    NaJSONLinesExporter). Subclasses may override start_span() or
+    export() instead. A tracer may be shared by several NaServers
+    and threads.
+    """
+
+    span_class = NaSpan
+
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+
+    def __deepcopy__(self, memo):
+        # shared by copies of an NaServer (see Cluster.vserver())
+        return self
+
+    def start_span(self, server, api, vserver):
+        """Returns the span of a call of 'api' on 'server'.
+        """
+
+        return self.span_class(self, server, api, vserver)
+
+    def export(self, span):
+        """Called with each finished span.
+        """
+
+        if (self.exporter != None):
+            self.exporter.export(span)
+
+
+class NaNullTracer(NaTracer) :
+    """The default tracer, which does not trace.
+    """
+
+    null_span = NaNullSpan()
+
+    def start_span(self, server, api, vserver):
+        return self.null_span
+
+
+NULL_TRACER = NaNullTracer()
+
+
+class NaJSONLinesExporter :
+    """Writes each span as one line of JSON to 'output', a file name
+    (which is appended to) or a file object.
+    """
+
+    def __init__(self, output):
+        if (isinstance(output, str)):
+            self.stream = open(output, "a")
+            self.owns_stream = True
+        else :
+            self.stream = output
+            self.owns_stream = False
+        self.lock = threading.Lock()
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), sort_keys=True) + "\n"
+        self.lock.acquire()
+        try:
+            self.stream.write(line)
+            self.stream.flush()
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """Closes the output file if the exporter opened it.
+        """
+
+        if (self.owns_stream):
+            self.stream.close()
@@ -1,2 +1,20 @@
-from ontap7mode import Filer, Volume, NaElement
-from ontapcmode import Cluster, ClusterVolume
+import sys
+
+from .ontap7mode import Filer, Volume, NaElement
+from .ontapcmode import Cluster, ClusterVolume
+from .NaTrace import NaTracer, NaJSONLinesExporter
+from .NaMetrics import NaMetricsRegistry
+from .NaElement import NaInternTable
+
+#asyncio is slow to import, so the asyncio client is only loaded when
+#one of its classes is first used
+ASYNC_NAMES = ('AsyncNaServer', 'AsyncFiler', 'AsyncCluster')
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name in ASYNC_NAMES:
+            from . import NaAsync
+            return getattr(NaAsync, name)
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+elif sys.version_info >= (3, 6):
+    from .NaAsync import AsyncNaServer, AsyncFiler, AsyncCluster
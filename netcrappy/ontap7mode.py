@@ -3,8 +3,9 @@ import time
 import re
 import copy
 
-from NaServer import NaServer
-from NaElement import NaElement
+from .NaServer import NaServer
+from .NaElement import NaElement
+from .NaSchema import compile_schema
 
 class NetCrAPIOut(Exception):
     '''
@@ -41,7 +42,7 @@ def dict_to_naelement(naelem_dict, parent_naelem=None):
     attrs = None
     #if not parent_naelem and len(naelem_dict) > 2 and 'attrs' not in naelem_dict:
     #    raise NetCrAPIOut('There can only be ONE (top level element)!')
-    for k, v in naelem_dict.iteritems():
+    for k, v in naelem_dict.items():
         if k == 'attrs':
             attrs = v
             #print "attrs: "
@@ -64,18 +65,63 @@ def dict_to_naelement(naelem_dict, parent_naelem=None):
                     parent_naelem.child_add_string(k, v)
     if not parent_naelem:
         if attrs:
-            for k, v  in attrs.iteritems():
+            for k, v  in attrs.items():
                 new_naelem.attr_set(k, v)
         return new_naelem
 
 
+AGGR_LIST_INFO = {"aggregates": {
+                  "is_list": True,
+                  "name": "string",
+                  "state": "string",
+                  "size-total": "integer",
+                  "size-used": "integer",
+                  "size-available": "integer",
+                  "volume-count": "integer",
+                  "has-local-root": "boolean"
+                 }}
+
+SYSTEM_INFO = {"system-info":{"is_list": False,
+                    "backplane-part-number": "string", 
+                    "backplane-revision": "string",
+                    "backplane-serial-number": "string",
+                    "board-speed": "integer",
+                    "board-type": "string",
+                    "controller-address": "string",
+                    "cpu-ciob-revision-id": "string",
+                    "cpu-firmware-release": "string",
+                    "cpu-microcode-version": "string",
+                    "cpu-part-number": "string",
+                    "cpu-processor-id": "string",
+                    "cpu-processor-type": "string",
+                    "cpu-revision": "string",
+                    "cpu-serial-number": "string",
+                    "memory-size": "integer",
+                    "number-of-processors": "integer",
+                    "partner-system-id": "string",
+                    "partner-system-name": "string",
+                    "partner-system-serial-number": "string",
+                    "prod-type": "string",
+                    "supports-raid-array": "boolean",
+                    "system-id": "string",
+                    "system-machine-type": "string",
+                    "system-model": "string",
+                    "system-name": "string",
+                    "system-revision": "string",
+                    "system-serial-number": "string",
+                    "vendor-id": "string"
+                   }}
+
+
 class Filer:
     '''
     Class for interacting with Filers or Clusters
     '''
-    def __init__(self, filer_name, user, password, transport_type='HTTPS', apiversion=(1,19)):
+    def __init__(self, filer_name, user, password, transport_type='HTTPS', apiversion=(1,19), warm_up=False):
         '''
         Creates the connection to the filer. Transport_type defaults to 'HTTPS'.
+        With warm_up, a connection is opened (and the TLS handshake done)
+        right away instead of on the first call.
         Todo:
             Allow different connection styles?
         '''
@@ -86,6 +132,9 @@ class Filer:
         check_zapi_error(out, "connection to filer failed: %s")
         out = conn.set_admin_user(user, password)
         check_zapi_error(out, "connection to filer failed: %s")
+        if warm_up:
+            out = conn.warm_up()
+            check_zapi_error(out, "connection to filer failed: %s")
         self.conn = conn
         
     def invoke(self, *args):
@@ -99,17 +148,39 @@ class Filer:
         check_zapi_error(out)
         return out
 
-    def invoke_elem(self, naelem):
+    def invoke_elem(self, naelem, vserver=None, parser=None):
         """@todo: Docstring for invoke_elem.
 
         :naelem: NaElement object
+        :vserver: vserver to tunnel this call to, instead of the
+                  connection's vserver
+        :parser: parser of the response instead of one of the
+                 connection's parse backend, see NaServer.invoke_elem()
         :returns: output object
 
         """
-        out = self.conn.invoke_elem(naelem)
+        out = self.conn.invoke_elem(naelem, vserver, parser)
         check_zapi_error(out)
         return out
 
+    def invoke_many(self, requests, max_workers=None):
+        """Runs a batch of independent API calls concurrently over the
+        connection pool, see NaServer.invoke_many().
+
+        :requests: list of NaElement objects or (api, args) tuples
+        :max_workers: number of calls in flight at once
+        :returns: list of output objects in the order of requests, with
+                  a NetCrAPIOut exception in place of each failed call
+
+        """
+        outputs = self.conn.invoke_many(requests, max_workers)
+        for i, out in enumerate(outputs):
+            try:
+                check_zapi_error(out)
+            except NetCrAPIOut as e:
+                outputs[i] = e
+        return outputs
+
     def invoke_cli(self, command):
         """Undocumented API that runs supplied arguments as a command. API
         documentation and python code found here:
@@ -168,9 +239,11 @@ class Filer:
         api_obj is a list that needs to be retrieved with 'get_children()'.
         Note that the api structure can contain nested dictionaries;
         each of these dictionaries will need an 'is_list' value/key pair.
+        For a structure used over and over, NaSchema.compile_schema()
+        returns a function that extracts the same dict much faster.
         """
         return_dict = {}
-        for k, v in api_structure.iteritems():
+        for k, v in api_structure.items():
             if isinstance(v, dict) and v['is_list']:
                 #print "group %s from %s" % (k, api_obj)
                 api_obj_list = api_obj.child_get(k).children_get()
@@ -296,17 +369,7 @@ class Filer:
 
         """
         out = self.invoke('aggr-list-info')
-        aggr_info_items = {"aggregates": {
-                           "is_list": True,
-                           "name": "string",
-                           "state": "string",
-                           "size-total": "integer",
-                           "size-used": "integer",
-                           "size-available": "integer",
-                           "volume-count": "integer",
-                           "has-local-root": "boolean"
-                          }}
-        aggr_info = self.api_recurse(aggr_info_items, out)
+        aggr_info = compile_schema(AGGR_LIST_INFO)(out)
         return aggr_info['aggregates']            
 
     def create_vol(self, name, aggr, size):
@@ -329,37 +392,7 @@ class Filer:
 
         """
         out = self.invoke('system-get-info')
-        system_info_objs = {"system-info":{"is_list": False,
-                            "backplane-part-number": "string", 
-                            "backplane-revision": "string",
-                            "backplane-serial-number": "string",
-                            "board-speed": "integer",
-                            "board-type": "string",
-                            "controller-address": "string",
-                            "cpu-ciob-revision-id": "string",
-                            "cpu-firmware-release": "string",
-                            "cpu-microcode-version": "string",
-                            "cpu-part-number": "string",
-                            "cpu-processor-id": "string",
-                            "cpu-processor-type": "string",
-                            "cpu-revision": "string",
-                            "cpu-serial-number": "string",
-                            "memory-size": "integer",
-                            "number-of-processors": "integer",
-                            "partner-system-id": "string",
-                            "partner-system-name": "string",
-                            "partner-system-serial-number": "string",
-                            "prod-type": "string",
-                            "supports-raid-array": "boolean",
-                            "system-id": "string",
-                            "system-machine-type": "string",
-                            "system-model": "string",
-                            "system-name": "string",
-                            "system-revision": "string",
-                            "system-serial-number": "string",
-                            "vendor-id": "string"
-                           }}
-        sysinfo = self.api_recurse(system_info_objs, out)
+        sysinfo = compile_schema(SYSTEM_INFO)(out)
         return sysinfo['system-info']
 
 
@@ -427,7 +460,7 @@ class Volume:
         vol_info_dict = {}
         if len(volumes) == 1:
             vol = volumes[0]
-            for key, value in volume_info.iteritems():
+            for key, value in volume_info.items():
                 if value == 'string':
                     vol_info_dict[key] = vol.child_get_string(key)
                 elif value == 'integer':
@@ -619,7 +652,7 @@ class Volume:
         """
         list_in = NaElement('snapshot-set-schedule')
         list_in.child_add_string('volume', self.name)
-        for snap_interval, snap_count in snap_sched.iteritems():
+        for snap_interval, snap_count in snap_sched.items():
             list_in.child_add_string(snap_interval, snap_count)
         out = self.invoke_elem(list_in)
         check_zapi_error(out)
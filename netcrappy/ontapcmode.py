@@ -3,22 +3,188 @@ import time
 import re
 import copy
 
-from NaServer import NaServer
-from NaElement import NaElement
+from .NaServer import NaServer
+from .NaElement import NaElement
+from .NaPath import select, NaColumns
+from .NaSchema import compile_schema, schema_paths, desired_attributes
+from .NaStream import NaStreamParser
+
+from . import ontap7mode
+
+AGGR_INFO = {'aggregate-name': 'string',
+             'aggr-space-attributes':{
+                 'is_list': False,
+                 'size-available': 'integer',
+                 'size-total': 'integer',
+                 'size-used': 'integer'
+            }}
+
+
+#the records of iter APIs, for their desired-attributes
+ITER_RECORDS = {'aggr-get-iter': 'aggr-attributes',
+                'lun-get-iter': 'lun-info',
+                'net-interface-get-iter': 'net-interface-info',
+                'qtree-list-iter': 'qtree-info',
+                'snapshot-get-iter': 'snapshot-info',
+                'volume-get-iter': 'volume-attributes',
+                'vserver-get-iter': 'vserver-info'}
+
+VSERVER_PATHS = ('vserver-name', 'state', 'vserver-type',
+                 'allowed-protocols:element',
+                 'vserver-aggr-info-list:element')
+
+VOLUME_PATHS = ('volume-id-attributes/name',
+                'volume-id-attributes/owning-vserver-name',
+                'volume-state-attributes/state')
+
+VOLUME_INFO = {'volume-autosize-attributes': {
+                   'is_list': False,
+                   'maximum-size': 'integer',
+                   'increment-size': 'integer',
+                   'is-enabled': 'boolean'
+               },
+               'volume-id-attributes': {
+                   'is_list': False,
+                   'containing-aggregate-name': 'string',
+                   'type': 'string',
+                   'owning-vserver-name': 'string'
+               },
+               'volume-inode-attributes': {
+                   'is_list': False,
+                   'files-total': 'integer',
+                   'files-used': 'integer',
+                   'block-type': 'string'
+               },
+               'volume-state-attributes': {
+                   'is_list': False,
+                   'state': 'string'
+               },
+               'volume-space-attributes': {
+                   'is_list': False,
+                   'percentage-size-used': 'integer',
+                   'size-total': 'integer',
+                   'size-available': 'integer',
+                   'size-used': 'integer',
+                   'size-used-by-snapshots': 'integer',
+                   'space-guarantee': 'string',
+                   'size': 'integer',
+                   'percentage-snapshot-reserve': 'integer',
+                   'percentage-fractional-reserve': 'integer',
+               },
+               'volume-sis-attributes': {
+                   'is_list': False,
+                   'is-sis-volume': 'boolean',
+                   'deduplication-space-saved': 'integer',
+                   'compression-space-saved': 'integer',
+                   'total-space-saved': 'integer'
+               }
+              }
+
+
+def iter_request(iter_api, desired=None, next_tag=None):
+    """
+    Returns the request of a page of the iter API 'iter_api', the
+    first page without 'next_tag'. 'desired' is the desired-attributes
+    element of the request, or None to get all the attributes.
+    """
+    iter_in = NaElement(iter_api)
+    if desired is not None:
+        iter_in.child_add(desired)
+    if next_tag is not None:
+        iter_in.child_add_string('tag', next_tag)
+    return iter_in
+
+
+def iter_desired_attributes(iter_api, fields):
+    """
+    Returns the desired-attributes element asking for the values of
+    'fields', an api_recurse() schema or NaPath paths, in the records
+    of 'iter_api', or None if 'fields' is None or the name of the
+    records of 'iter_api' is not in ITER_RECORDS.
+    """
+    if fields is None or iter_api not in ITER_RECORDS:
+        return None
+    return desired_attributes(ITER_RECORDS[iter_api], fields)
+
+
+def vserver_records(vservers):
+    """
+    Extracts a dict of information per vserver name from the
+    'vserver-info' elements returned by vserver-get-iter.
+    """
+    vserver_dict = {}
+    columns = select(vservers, *VSERVER_PATHS)
+    for name, state, type, protocols, aggrs in zip(*columns):
+        if protocols is not None:
+            allowed_protocols = []
+            for proto in protocols.children_get():
+                #it should work like this:
+                #allowed_protocols.append(proto.child_get_string('protocol'))
+                #but NOOOOOOOOOOOOOOOO
+                inside_xml = re.compile('<protocol>(.*)</protocol>')
+                allowed_protocols.append(inside_xml.findall(proto.sprintf())[0])
+        else:
+            allowed_protocols = None
+        if aggrs is not None:
+            #This will only return data if an aggr has been delegated 
+            #to the vserver
+            aggr_dict = {}
+            for aggr in aggrs.children_get():
+                aggr_name = aggr.child_get_string('aggr-name')
+                try:
+                    aggr_avail = aggr.child_get_int('aggr-availsize')
+                except ValueError:
+                    aggr_avail=0
+                aggr_dict[aggr_name] = {'aggr-availsize': aggr_avail}
+        else:
+            aggr_dict = None
+        vserver_dict[name] = {'state': state,
+                              'type': type,
+                              'allowed-protocols': allowed_protocols,
+                              'vserver-aggr-info': aggr_dict
+                             }
+    return vserver_dict
+
+
+def volume_records(volumes):
+    """
+    Extracts a dict of information per volume name from the
+    'volume-attributes' elements returned by volume-get-iter.
+    """
+    volumes_dict = {}
+    for name, owning_vserver, state in zip(*select(volumes, *VOLUME_PATHS)):
+        volumes_dict[name] = {'state': state,
+                              'owning-vserver-name': owning_vserver
+                             }
+    return volumes_dict
+
+
+def aggr_records(aggrs):
+    """
+    Extracts the space information per aggregate name from the
+    'aggr-attributes' elements returned by aggr-get-iter, in the form
+    returned by Cluster.get_aggrs().
+    """
+    aggr_out = {}
+    extract = compile_schema(AGGR_INFO)
+    for aggr in aggrs:
+        aggr_data = extract(aggr)
+        aggr_out[aggr_data['aggregate-name']] = aggr_data['aggr-space-attributes']
+    return aggr_out
 
-import ontap7mode
 
 class Cluster(ontap7mode.Filer):
 
     """Docstring for cluster. """
 
-    def __init__(self, filer_name, user, password, transport_type='HTTPS'):
+    def __init__(self, filer_name, user, password, transport_type='HTTPS', warm_up=False):
         """@todo: to be defined1. """
         ontap7mode.Filer.__init__(self,
                                  filer_name,
                                  user,
                                  password,
-                                 transport_type='HTTPS')
+                                 transport_type='HTTPS',
+                                 warm_up=warm_up)
         self.vserver_objs = {}
         #for vserver in self.get_vservers():
         #    vserver_obj = copy.deepcopy(self)
@@ -50,67 +216,102 @@ class Cluster(ontap7mode.Filer):
             #or generate a new object and place in a dict for later use
             vserver_obj = copy.deepcopy(self)
             vserver_obj.set_vserver(vserver_name)
-            self.vserver_objs[vserver_name] = vserver_obj
+            #another thread may have got there first; keep its object
+            vserver_obj = self.vserver_objs.setdefault(vserver_name,
+                                                       vserver_obj)
         return vserver_obj
 
-    def api_get_iter(self,  iter_api):
+    def api_get_iter(self,  iter_api, vserver=None, columns=None, numpy=False,
+                     desired=None):
         """@todo: Docstring for api_get_iter.
 
         :iter_api: @todo
+        :vserver: vserver to run the API against, instead of the
+                  connection's vserver
+        :columns: NaPath paths, or an api_recurse() schema without
+                  lists, to return a dict of columns by path instead
+                  of the records, see NaPath.NaColumns; each page is
+                  reduced to its columns as it arrives
+        :numpy: with columns, return the integer and boolean columns
+                as NumPy arrays
+        :desired: api_recurse() schema or NaPath paths of the values
+                  that will be read, to ask the server for only those
+                  (see ITER_RECORDS); the columns by default
         :returns: @todo
 
         """
-        obj_list = []
-        objs = self.invoke(iter_api)
-        obj_list = obj_list + objs.child_get('attributes-list').children_get()
-        next_tag = objs.child_get_string('next-tag')
-        while next_tag is not None:
-            objs = self.invoke(iter_api, 'tag', next_tag)
-            obj_list = obj_list + objs.child_get('attributes-list').children_get()
+        if columns is not None:
+            if isinstance(columns, dict):
+                columns = schema_paths(columns)
+            store = NaColumns(columns)
+            add_records = store.add
+            if desired is None:
+                desired = columns
+        else:
+            obj_list = []
+            add_records = obj_list.extend
+        desired = iter_desired_attributes(iter_api, desired)
+        iter_in = iter_request(iter_api, desired)
+        while True:
+            objs = self.invoke_elem(iter_in, vserver)
+            attributes_list = objs.child_get('attributes-list')
+            if attributes_list is not None:
+                add_records(attributes_list.children_get())
             next_tag = objs.child_get_string('next-tag')
+            if next_tag is None:
+                break
+            iter_in = iter_request(iter_api, desired, next_tag)
+        if columns is not None:
+            return store.to_dict(numpy)
         return obj_list
 
+    def api_stream_iter(self, iter_api, schema, callback=None, vserver=None):
+        """Runs the iter API through all its pages, extracting each
+        record with an api_recurse() schema while the response is
+        parsed, see NaStream. The records are never built as
+        NaElements, and the elements the schema does not name are
+        skipped, or not even sent by the server if the records of
+        the API are in ITER_RECORDS.
+
+        :iter_api: name of the iter API, such as 'volume-get-iter'
+        :schema: api_recurse() schema of a record
+        :callback: function called with each record as it is parsed;
+                   the records of the pages before a failed call
+                   have been passed to it already
+        :vserver: vserver to run the API against, instead of the
+                  connection's vserver
+        :returns: the list of records, or with callback, the number
+                  of records passed to it
+
+        """
+        if callback is None:
+            records = []
+            callback = records.append
+        else:
+            records = None
+        count = 0
+        desired = iter_desired_attributes(iter_api, schema)
+        iter_in = iter_request(iter_api, desired)
+        while True:
+            parser = NaStreamParser(schema, callback,
+                                    intern_table=self.conn.get_intern_table())
+            objs = self.invoke_elem(iter_in, vserver, parser)
+            count = count + parser.count
+            next_tag = objs.child_get_string('next-tag')
+            if next_tag is None:
+                break
+            iter_in = iter_request(iter_api, desired, next_tag)
+        if records is None:
+            return count
+        return records
+
     def get_vservers(self):
         """@todo: Docstring for get_vservers.
         :returns: @todo
 
         """
-        vserver_list = self.api_get_iter('vserver-get-iter')
-        vserver_dict = {}
-        for vserver in vserver_list:
-            name = vserver.child_get_string('vserver-name')
-            state = vserver.child_get_string('state')
-            type = vserver.child_get_string('vserver-type')
-            if vserver.child_get('allowed-protocols') is not None:
-                allowed_protocols = []
-                for proto in vserver.child_get('allowed-protocols').children_get():
-                    #it should work like this:
-                    #allowed_protocols.append(proto.child_get_string('protocol'))
-                    #but NOOOOOOOOOOOOOOOO
-                    inside_xml = re.compile('<protocol>(.*)</protocol>')
-                    allowed_protocols.append(inside_xml.findall(proto.sprintf())[0])
-            else:
-                allowed_protocols = None
-            if vserver.child_get('vserver-aggr-info-list'):
-                #This will only return data if an aggr has been delegated 
-                #to the vserver
-                aggr_dict = {}
-                for aggr in vserver.child_get('vserver-aggr-info-list').children_get():
-                    aggr_name = aggr.child_get_string('aggr-name')
-                    try:
-                        aggr_avail = aggr.child_get_int('aggr-availsize')
-                    except ValueError:
-                        aggr_avail=0
-                    aggr_dict[aggr_name] = {'aggr-availsize': aggr_avail}
-            else:
-                aggr_dict = None
-
-            vserver_dict[name] = {'state': state,
-                                  'type': type,
-                                  'allowed-protocols': allowed_protocols,
-                                  'vserver-aggr-info': aggr_dict
-                                 }
-        return vserver_dict
+        vserver_list = self.api_get_iter('vserver-get-iter', desired=VSERVER_PATHS)
+        return vserver_records(vserver_list)
 
     def get_volumes(self, vserver=None, max_records=20):
         """@todo: Docstring for get_volumes.
@@ -119,24 +320,10 @@ class Cluster(ontap7mode.Filer):
         :returns: @todo
 
         """
-        if vserver:
-            orig_vserver = self.conn.get_vserver()
-            if vserver in self.get_vservers():
-                self.set_vserver(vserver)
-            else:
-                raise ontap7mode.NetCrAPIOut('VServer does not exist')
-        volume_list = self.api_get_iter('volume-get-iter')
-        if vserver:
-            self.set_vserver(orig_vserver)
-        volumes_dict = {}
-        for volume in volume_list:
-            name = volume.child_get('volume-id-attributes').child_get_string('name')
-            owning_vserver = volume.child_get('volume-id-attributes').child_get_string('owning-vserver-name')
-            state = volume.child_get('volume-state-attributes').child_get_string('state')
-            volumes_dict[name] = { 'state': state,
-                                  'owning-vserver-name': owning_vserver
-                                 }
-        return volumes_dict
+        if vserver and vserver not in self.get_vservers():
+            raise ontap7mode.NetCrAPIOut('VServer does not exist')
+        volume_list = self.api_get_iter('volume-get-iter', vserver, desired=VOLUME_PATHS)
+        return volume_records(volume_list)
 
     def create_vol(self, name, aggr, size, vserver_name=None):
         """@todo: Docstring for create_vol.
@@ -168,23 +355,8 @@ class Cluster(ontap7mode.Filer):
                 'size-used': <integer>},
                 ...}
         """
-        aggr_info = {'aggregate-name': 'string',
-                     'aggr-space-attributes':{
-                         'is_list': False,
-                         'size-available': 'integer',
-                         'size-total': 'integer',
-                         'size-used': 'integer'
-                    }}
-
-        aggrs = self.api_get_iter('aggr-get-iter')
-        aggr_out = {}
-        for aggr in aggrs:
-            aggr_data = self.api_recurse(aggr_info, aggr)
-            #print aggr_data
-            aggr_name = aggr_data['aggregate-name']
-            aggr_space = aggr_data['aggr-space-attributes']
-            aggr_out[aggr_name] = aggr_space
-        return aggr_out
+        aggrs = self.api_get_iter('aggr-get-iter', desired=AGGR_INFO)
+        return aggr_records(aggrs)
         
 
 class ClusterVolume(ontap7mode.Volume):
@@ -196,42 +368,6 @@ class ClusterVolume(ontap7mode.Volume):
         :returns: @todo
 
         """
-        volume_info = {'volume-autosize-attributes': {
-                           'maximum-size': 'integer',
-                           'increment-size': 'integer',
-                           'is-enabled': 'boolean'
-                       },
-                       'volume-id-attributes': {
-                           'containing-aggregate-name': 'string',
-                           'type': 'string',
-                           'owning-vserver-name': 'string'
-                       },
-                       'volume-inode-attributes': {
-                           'files-total': 'integer',
-                           'files-used': 'integer',
-                           'block-type': 'string'
-                       },
-                       'volume-state-attributes': {
-                           'state': 'string'
-                       },
-                       'volume-space-attributes': {
-                           'percentage-size-used': 'integer',
-                           'size-total': 'integer',
-                           'size-available': 'integer',
-                           'size-used': 'integer',
-                           'size-used-by-snapshots': 'integer',
-                           'space-guarantee': 'string',
-                           'size': 'integer',
-                           'percentage-snapshot-reserve': 'integer',
-                           'percentage-fractional-reserve': 'integer',
-                       },
-                       'volume-sis-attributes': {
-                           'is-sis-volume': 'boolean',
-                           'deduplication-space-saved': 'integer',
-                           'compression-space-saved': 'integer',
-                           'total-space-saved': 'integer'
-                       }
-                      }
         vol_get_iter = NaElement('volume-get-iter')
         query = NaElement('query')
         vol_query_attrs = NaElement('volume-attributes')
@@ -240,26 +376,14 @@ class ClusterVolume(ontap7mode.Volume):
         query.child_add(vol_query_attrs)
         vol_query_attrs.child_add(vol_id_attrs)
         vol_id_attrs.child_add_string('name', self.name)
+        vol_get_iter.child_add(desired_attributes('volume-attributes', VOLUME_INFO))
         out = self.invoke_elem(vol_get_iter)
         attributes_list = out.child_get('attributes-list').children_get()[0]
         #print attributes_list.sprintf()
         vol_info_dict = {}
-        for vol_attribute_type, attributes in volume_info.iteritems():
-            attribute_group = attributes_list.child_get(vol_attribute_type)
-            for attr_name, data_type in attributes.iteritems():
-                #print vol_attribute_type
-                #print attribute_group
-                #print attr_name
-                #print data_type
-                if data_type == 'string':
-                    data = attribute_group.child_get_string(attr_name)
-                    vol_info_dict[attr_name] = data
-                elif data_type == 'integer':
-                    data = attribute_group.child_get_int(attr_name)
-                    vol_info_dict[attr_name] = data
-                elif data_type == 'boolean':
-                    data = (attribute_group.child_get_string(attr_name) == 'true')
-                    vol_info_dict[attr_name] = data
+        for attribute_group in compile_schema(VOLUME_INFO)(attributes_list).values():
+            if attribute_group is not None:
+                vol_info_dict.update(attribute_group)
         return vol_info_dict
 
     def offline(self):